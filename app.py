@@ -1,10 +1,17 @@
 import os
-import io
 import tempfile
-import pandas as pd
 import streamlit as st
 
-from save_code import run_lookup
+from table_io import PARQUET, parquet_available
+
+# save_code (pandas, selenium, requests) and pandas are imported only when they are needed,
+# so reruns triggered by widget clicks stay fast.
+
+OUTPUT_MIME = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
 
 st.set_page_config(page_title="Tra cứu MST theo CCCD", layout="wide")
 st.markdown(
@@ -61,13 +68,28 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
-if "logs" not in st.session_state:
-    st.session_state["logs"] = []
-if "output_path" not in st.session_state:
-    st.session_state["output_path"] = None
+STATUS_TEXT = {
+    "queued": "Đang chờ",
+    "running": "Đang chạy",
+    "paused": "Tạm dừng",
+    "cancelling": "Đang dừng",
+    "done": "Hoàn tất",
+    "cancelled": "Đã dừng",
+    "failed": "Lỗi",
+}
+
+
+@st.cache_resource
+def job_manager():
+    # One manager per server process: jobs outlive page reloads and are shared by all sessions
+    from jobs import JobManager
+
+    return JobManager(max_workers=int(os.getenv("MAX_JOBS", "2")))
 
-progress_bar = st.progress(0, text="Chưa chạy")
-log_box = st.empty()
+
+manager = job_manager()
+# The job id lives in the URL, so a refreshed page attaches to the same job
+job_id = st.query_params.get("job")
 
 
 uploaded = st.file_uploader("Chọn file Excel đầu vào (cột CCCD bắt buộc)", type=["xlsx", "xls", "csv"])
@@ -78,69 +100,136 @@ show_browser = st.checkbox(
     value=default_show_browser,
 )
 show_logs = st.checkbox("Hiển thị log chi tiết", value=False)
+engine = st.radio(
+    "Chế độ tra cứu",
+    options=["selenium", "http"],
+    format_func=lambda e: "Trình duyệt Chrome (Selenium)" if e == "selenium" else "HTTP trực tiếp (nhanh, không cần Chrome)",
+    horizontal=True,
+)
+workers = st.number_input("Số luồng chạy song song", min_value=1, max_value=8, value=1, step=1)
+tabs = st.number_input(
+    "Số tab mỗi trình duyệt (Selenium, tiết kiệm RAM hơn thêm luồng)",
+    min_value=1, max_value=8, value=1, step=1,
+    disabled=engine != "selenium",
+)
+adaptive = st.checkbox("Tự điều chỉnh tốc độ theo phản hồi của trang (AIMD)", value=False)
+# Parquet is offered only when pyarrow is installed (it is not in requirements.txt)
+output_format = st.radio(
+    "Định dạng kết quả",
+    options=[f for f in OUTPUT_MIME if f != PARQUET or parquet_available()],
+    format_func=lambda f: {"xlsx": "Excel (.xlsx)", "csv": "CSV", "parquet": "Parquet"}[f],
+    horizontal=True,
+)
 
-col1, col2 = st.columns([1, 1])
-run_clicked = col1.button("Run tra cứu", type="primary", use_container_width=True, disabled=uploaded is None)
-clear_clicked = col2.button("Xóa log", use_container_width=True)
-
-if clear_clicked:
-    st.session_state["logs"] = []
-    log_box.text("")
-    progress_bar.progress(0, text="Chưa chạy")
+run_clicked = st.button("Run tra cứu", type="primary", use_container_width=True, disabled=uploaded is None)
 
 if run_clicked and uploaded:
     # Lưu file upload vào temp
     workdir = tempfile.mkdtemp(prefix="mst_lookup_")
-    input_path = os.path.join(workdir, "input.xlsx")
+    # Keep the upload's own extension (CSV used to be saved as input.xlsx); the format is
+    # detected from the content anyway
+    ext = os.path.splitext(uploaded.name)[1].lower() or ".xlsx"
+    input_path = os.path.join(workdir, f"input{ext}")
     with open(input_path, "wb") as f:
-        f.write(uploaded.read())
+        f.write(uploaded.getbuffer())
 
-    output_path = os.path.join(workdir, "output.xlsx")
-    st.session_state["output_path"] = output_path
-
-    st.info("Bắt đầu chạy, vui lòng chờ...")
-    def update_progress(done, total):
-        ratio = done / total if total else 0
-        progress_bar.progress(ratio, text=f"Đang chạy: {done}/{total}")
-
-    def log_ui(msg: str):
-        if not show_logs:
-            return
-        st.session_state["logs"].append(str(msg))
-        log_box.text("\n".join(st.session_state["logs"][-200:]))  # keep last 200 lines
-
-    run_lookup(
+    job = manager.submit(
         input_path,
-        output_path,
-        log_fn=log_ui,
+        os.path.join(workdir, f"output.{output_format}"),
         headless=not show_browser,
-        progress_fn=update_progress,
+        engine=engine,
+        workers=int(workers),
+        tabs=int(tabs),
+        adaptive=adaptive,
+        output_format=output_format,
     )
-    progress_bar.progress(1.0, text="Hoàn tất")
-    st.success("Đã chạy xong.")
+    job_id = job.id
+    st.query_params["job"] = job_id
 
-if st.session_state.get("output_path") and os.path.exists(st.session_state["output_path"]):
-    st.subheader("Xem trước kết quả")
-    excel_bytes = None
+
+def show_result(result_path, downloadable):
+    st.subheader("Xem trước kết quả" if downloadable else "Xem trước kết quả (đang chạy)")
+    result_format = os.path.splitext(result_path)[1].lstrip(".")
+    result_bytes = None
     try:
-        with open(st.session_state["output_path"], "rb") as f:
-            excel_bytes = f.read()
-        # preview từ buffer để tránh lỗi handle
-        df_preview = pd.read_excel(io.BytesIO(excel_bytes), dtype=str)
-        st.dataframe(df_preview.head(50), use_container_width=True)
+        if downloadable:
+            with open(result_path, "rb") as f:
+                result_bytes = f.read()
+        # Preview only reads the first rows, whatever the size of the result
+        from table_io import iter_chunks
+
+        chunks = iter_chunks(result_path, chunk_size=50)
+        try:
+            df_preview = next(chunks, None)
+        finally:
+            chunks.close()  # release the file handle right away
+        if df_preview is not None:
+            st.dataframe(df_preview, use_container_width=True)
     except Exception as e:
         st.info(f"Không đọc được preview: {e}")
 
-    if excel_bytes:
+    if result_bytes:
         try:
             st.download_button(
-                "Tải kết quả Excel",
-                data=excel_bytes,
-                file_name="ket_qua_mst.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                f"Tải kết quả ({result_format})",
+                data=result_bytes,
+                file_name=f"ket_qua_mst.{result_format}",
+                mime=OUTPUT_MIME.get(result_format, "application/octet-stream"),
                 use_container_width=True,
             )
         except Exception as e:
             st.warning(f"Không tạo được nút tải: {e}")
 
-st.caption("Cần thư viện: streamlit, selenium, webdriver-manager, pandas.")
+
+def show_job(job, polling):
+    status = job.status
+    ratio = job.done / job.total if job.total else (1.0 if job.finished else 0.0)
+    speed = f" · {job.rate:.2f} req/s" if job.rate and not job.finished else ""
+    st.progress(min(ratio, 1.0), text=f"{STATUS_TEXT[status]}: {job.done}/{job.total}{speed}")
+    st.caption(f"Job {job.id}")
+
+    # on_click callbacks run before the rerun, so the buttons already reflect the new state
+    col1, col2, col3 = st.columns([1, 1, 1])
+    if status == "paused":
+        col1.button("Tiếp tục", use_container_width=True, on_click=job.resume)
+    else:
+        col1.button("Tạm dừng", use_container_width=True, on_click=job.pause, disabled=status not in ("queued", "running"))
+    col2.button("Dừng", use_container_width=True, on_click=job.cancel, disabled=job.finished or status == "cancelling")
+    col3.button("Xóa log", use_container_width=True, on_click=job.clear_logs)
+
+    if job.error:
+        st.error(f"Lỗi: {job.error}")
+    elif status == "done":
+        st.success("Đã chạy xong.")
+    if show_logs:
+        st.text("\n".join(job.logs(200)))  # keep last 200 lines
+
+    if os.path.exists(job.output_path):
+        show_result(job.output_path, downloadable=job.finished)
+    if polling and job.finished:
+        st.rerun()  # full rerun stops the polling
+
+
+job = manager.get(job_id) if job_id else None
+# Jobs of this browser session only: other users' jobs (and their files) stay private
+my_jobs = st.session_state.setdefault("my_jobs", [])
+if job is not None and job.id not in my_jobs:
+    my_jobs.append(job.id)
+if job_id and job is None:
+    st.info("Job không còn trên máy chủ (máy chủ đã khởi động lại?).")
+if job is not None:
+    polling = not job.finished
+    # Only this block reruns every second while the job is active; the rest of the page stays idle
+    st.fragment(run_every=1.0 if polling else None)(show_job)(job, polling)
+else:
+    st.progress(0, text="Chưa chạy")
+
+others = [other for other in map(manager.get, reversed(my_jobs)) if other is not None and other is not job]
+if others:
+    with st.expander(f"Các job khác của bạn ({len(others)})"):
+        for other in others:
+            st.markdown(
+                f"[{other.id}](?job={other.id}) · {STATUS_TEXT[other.status]} · {other.done}/{other.total}"
+            )
+
+st.caption("Cần thư viện: streamlit, selenium, webdriver-manager, pandas, requests, lxml.")
@@ -0,0 +1,62 @@
+"""
+Micro-benchmark + regression check for result_parser.parse_result_page.
+
+    python bench_parser.py            # all fixtures, 200 iterations each
+    python bench_parser.py -n 50 fixtures/detail_person.html
+
+Prints pages/second per fixture and exits non-zero if a fixture no longer parses to the
+expected result, so parsing cost and correctness can be tracked without a browser.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+from result_parser import BLOCKED, DETAIL, LIST, parse_result_page
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# fixture file name -> (page_type, mst, name). Only detail_person.html is a captured page;
+# search_list.html and blocked.html are synthetic (see the comment at the top of each file)
+EXPECTED = {
+    "detail_person.html": (DETAIL, "012205001897", "Lường Văn Ngọc"),
+    "search_list.html": (LIST, "", ""),
+    "blocked.html": (BLOCKED, "", ""),
+}
+
+
+def bench(path, iterations):
+    with open(path, "rb") as f:
+        page = f.read()
+    result = parse_result_page(page)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        parse_result_page(page)
+    elapsed = time.perf_counter() - start
+    return result, iterations / elapsed if elapsed else float("inf"), len(page)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="HTML files (default: fixtures/*.html)")
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(os.path.join(FIXTURE_DIR, "*.html")))
+    failures = 0
+    for path in paths:
+        result, pages_per_sec, size = bench(path, args.iterations)
+        expected = EXPECTED.get(os.path.basename(path))
+        got = (result.page_type, result.mst, result.name)
+        flag = ""
+        if expected is not None and got != expected:
+            failures += 1
+            flag = f"  MISMATCH (expected {expected})"
+        print(f"{os.path.basename(path):<24} {size / 1024:7.1f} KiB  {pages_per_sec:8.1f} pages/s  {got}{flag}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
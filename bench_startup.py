@@ -0,0 +1,66 @@
+"""
+Import-time budget check for save_code (imported on every Streamlit rerun).
+
+    python bench_startup.py               # 5 fresh interpreters, 150 ms budget
+    python bench_startup.py -n 10 --budget-ms 100
+
+Each run imports save_code in a new interpreter and measures it with -X importtime. Exits
+non-zero if the median exceeds the budget or if a heavy dependency got imported eagerly.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+# Must only be imported once a lookup actually starts
+LAZY_MODULES = ("pandas", "numpy", "selenium", "requests", "lxml", "asyncio", "webdriver_manager")
+
+_PROBE = "import sys, save_code; print(','.join(m for m in {mods!r} if m in sys.modules))"
+_IMPORTTIME_RE = re.compile(r"import time:\s*\d+\s*\|\s*(\d+)\s*\|\s*save_code\s*$", re.M)
+
+
+def measure(module_dir):
+    """(cumulative import time of save_code in ms, eagerly imported heavy modules)."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(mods=LAZY_MODULES)],
+        cwd=module_dir,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    match = _IMPORTTIME_RE.search(proc.stderr)
+    micros = int(match.group(1)) if match else 0
+    loaded = [m for m in proc.stdout.strip().split(",") if m]
+    return micros / 1000, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=150.0)
+    args = parser.parse_args()
+
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    eager = set()
+    for _ in range(args.runs):
+        ms, loaded = measure(module_dir)
+        timings.append(ms)
+        eager.update(loaded)
+
+    median = statistics.median(timings)
+    print(f"import save_code: median {median:.1f} ms, min {min(timings):.1f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    failures = 0
+    if median > args.budget_ms:
+        failures += 1
+        print("  OVER BUDGET")
+    if eager:
+        failures += 1
+        print(f"  imported eagerly: {', '.join(sorted(eager))}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
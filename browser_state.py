@@ -0,0 +1,143 @@
+"""
+Warm browser state shared by every driver and HTTP session.
+
+Cookies and localStorage of masothue.com (consent choices, anti-bot clearance, ad-overlay
+flags, ...) are captured from a driver that completed a lookup, stored as JSON on disk and
+injected into every new driver before its first page load, so a restarted browser does not
+have to go through banners and overlays again. The same cookies seed the HTTP engine's jar.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Runs in the page: copy localStorage into one plain object
+_READ_STORAGE_JS = """
+const items = {};
+for (let i = 0; i < window.localStorage.length; i++) {
+    const key = window.localStorage.key(i);
+    items[key] = window.localStorage.getItem(key);
+}
+return {origin: window.location.origin, items: items};
+"""
+
+# Injected into every new document: restore missing localStorage items for their origin
+_RESTORE_STORAGE_JS = """
+(() => {
+    const saved = %s;
+    const items = saved[window.location.origin];
+    if (!items) return;
+    try {
+        for (const [key, value] of Object.entries(items)) {
+            if (window.localStorage.getItem(key) === null) window.localStorage.setItem(key, value);
+        }
+    } catch (e) {}
+})();
+"""
+
+
+class BrowserState:
+    """
+    {"cookies": [...selenium cookie dicts...], "local_storage": {origin: {key: value}}, "saved_at": ts}
+    persisted at `path`. Thread-safe; writes are atomic.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.cookies = []
+        self.local_storage = {}
+        self.saved_at = 0.0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        with self._lock:
+            # Drop cookies that expired while the state sat on disk
+            self.cookies = [c for c in data.get("cookies", []) if c.get("expiry", now + 1) > now]
+            self.local_storage = data.get("local_storage", {})
+            self.saved_at = data.get("saved_at", 0.0)
+
+    def __bool__(self):
+        return bool(self.cookies or self.local_storage)
+
+    def capture(self, driver):
+        """Snapshot cookies and localStorage of the driver's current page and save them."""
+        cookies = driver.get_cookies()
+        storage = driver.execute_script(_READ_STORAGE_JS) or {}
+        with self._lock:
+            by_key = {(c.get("domain"), c.get("path"), c["name"]): c for c in self.cookies}
+            by_key.update({(c.get("domain"), c.get("path"), c["name"]): c for c in cookies})
+            self.cookies = list(by_key.values())
+            if storage.get("origin") and storage.get("items"):
+                self.local_storage[storage["origin"]] = storage["items"]
+            self.saved_at = time.time()
+            self._save()
+
+    def _save(self):
+        folder = os.path.dirname(self.path) or "."
+        os.makedirs(folder, exist_ok=True)
+        data = {"cookies": self.cookies, "local_storage": self.local_storage, "saved_at": self.saved_at}
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".browser_state_", suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def apply_to_driver(self, driver):
+        """
+        Inject the state into a fresh Chrome through DevTools, before it loads any page:
+        cookies via Network.setCookies, localStorage via a script run on every new document.
+        """
+        with self._lock:
+            cookies = list(self.cookies)
+            local_storage = dict(self.local_storage)
+        if cookies:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setCookies", {"cookies": [_cdp_cookie(c) for c in cookies]})
+        if local_storage:
+            driver.execute_cdp_cmd(
+                "Page.addScriptToEvaluateOnNewDocument",
+                {"source": _RESTORE_STORAGE_JS % json.dumps(local_storage, ensure_ascii=False)},
+            )
+
+    def apply_to_session(self, session):
+        """Seed a requests.Session cookie jar with the captured cookies."""
+        with self._lock:
+            cookies = list(self.cookies)
+        for c in cookies:
+            session.cookies.set(
+                c["name"],
+                c["value"],
+                domain=c.get("domain", ""),
+                path=c.get("path", "/"),
+                secure=c.get("secure", False),
+                expires=c.get("expiry"),
+            )
+
+
+def _cdp_cookie(cookie):
+    """Selenium get_cookies() dict -> DevTools Network.CookieParam."""
+    param = {
+        "name": cookie["name"],
+        "value": cookie["value"],
+        "domain": cookie.get("domain", ""),
+        "path": cookie.get("path", "/"),
+        "secure": cookie.get("secure", False),
+        "httpOnly": cookie.get("httpOnly", False),
+    }
+    if "expiry" in cookie:
+        param["expires"] = cookie["expiry"]
+    if cookie.get("sameSite") in ("Strict", "Lax", "None"):
+        param["sameSite"] = cookie["sameSite"]
+    return param
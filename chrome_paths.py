@@ -0,0 +1,143 @@
+"""
+Resolve the Chrome binary and chromedriver once, then reuse the pair.
+
+Probing the candidate paths and, above all, ChromeDriverManager().install() (a network round
+trip) used to happen on every driver start. The resolved pair is now kept in-process and in
+a small JSON file; it is reused as long as both files still exist unchanged (same size and
+mtime as when their versions were checked) and CHROME_BIN/CHROMEDRIVER_PATH did not change,
+so restarts, extra workers and offline machines never touch the network.
+"""
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+
+PATHS_CACHE_FILE = os.getenv("CHROME_PATHS_CACHE", "result/chrome_paths.json")
+
+# Support Streamlit Cloud/containers where Chrome is at a custom path
+CHROME_BIN_CANDIDATES = [
+    "/usr/bin/chromium",            # debian/ubuntu chromium package
+    "/usr/bin/chromium-browser",    # older ubuntu
+    "/usr/lib/chromium/chrome",     # some alpine builds
+    "/usr/bin/google-chrome",
+    "/usr/bin/google-chrome-stable",
+]
+CHROMEDRIVER_CANDIDATES = ["/usr/bin/chromedriver"]
+
+_resolved = None
+_lock = threading.Lock()
+
+
+def _fingerprint(path):
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, int(st.st_mtime)]
+
+
+def _version(path):
+    """'124.0.6367.91' from `<path> --version`, or '' if it cannot be run."""
+    if not path:
+        return ""
+    try:
+        out = subprocess.run([path, "--version"], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return ""
+    match = re.search(r"\d+(\.\d+)+", out)
+    return match.group(0) if match else ""
+
+
+def _env():
+    return {"CHROME_BIN": os.getenv("CHROME_BIN") or "", "CHROMEDRIVER_PATH": os.getenv("CHROMEDRIVER_PATH") or ""}
+
+
+def _still_valid(entry):
+    if not entry or entry.get("env") != _env():
+        return False
+    if entry.get("chrome_bin") and _fingerprint(entry["chrome_bin"]) != entry.get("chrome_fingerprint"):
+        return False
+    return _fingerprint(entry.get("driver_path")) == entry.get("driver_fingerprint")
+
+
+def _load(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save(path, entry):
+    folder = os.path.dirname(path) or "."
+    try:
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".chrome_paths_", suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass  # cache only; next start probes again
+
+
+def _probe(log_fn):
+    env = _env()
+    chrome_bin = None
+    for candidate in [env["CHROME_BIN"]] + CHROME_BIN_CANDIDATES:
+        if candidate and os.path.exists(candidate):
+            chrome_bin = candidate
+            break
+    if not chrome_bin:
+        log_fn("Chrome binary not found. Set CHROME_BIN to a valid path.")
+
+    driver_path = None
+    for candidate in [env["CHROMEDRIVER_PATH"]] + CHROMEDRIVER_CANDIDATES:
+        if candidate and os.path.exists(candidate):
+            driver_path = candidate
+            break
+    if driver_path is None:
+        # Download a Chromium-compatible driver to avoid version mismatch
+        from webdriver_manager.chrome import ChromeDriverManager
+        from webdriver_manager.core.utils import ChromeType
+
+        driver_path = ChromeDriverManager(chrome_type=ChromeType.CHROMIUM).install()
+
+    chrome_version = _version(chrome_bin)
+    driver_version = _version(driver_path)
+    if chrome_version and driver_version and chrome_version.split(".")[0] != driver_version.split(".")[0]:
+        log_fn(f"Warning: Chrome {chrome_version} and ChromeDriver {driver_version} major versions differ.")
+    return {
+        "env": env,
+        "chrome_bin": chrome_bin,
+        "chrome_version": chrome_version,
+        "chrome_fingerprint": _fingerprint(chrome_bin),
+        "driver_path": driver_path,
+        "driver_version": driver_version,
+        "driver_fingerprint": _fingerprint(driver_path),
+    }
+
+
+def resolve_chrome_paths(log_fn=print, cache_path=PATHS_CACHE_FILE):
+    """
+    (chrome_bin or None, chromedriver path). Probed and version-checked at most once per
+    install; later calls are served from memory, then from cache_path (None: memory only).
+    """
+    global _resolved
+    with _lock:
+        if not _still_valid(_resolved):
+            cached = _load(cache_path) if cache_path else None
+            if _still_valid(cached):
+                _resolved = cached
+            else:
+                _resolved = _probe(log_fn)
+                if cache_path:
+                    _save(cache_path, _resolved)
+                log_fn(
+                    f"Resolved Chrome {_resolved['chrome_version'] or '?'} at {_resolved['chrome_bin']}, "
+                    f"ChromeDriver {_resolved['driver_version'] or '?'} at {_resolved['driver_path']}"
+                )
+        return _resolved["chrome_bin"], _resolved["driver_path"]
@@ -0,0 +1,264 @@
+"""
+Supervision of long-running Chrome drivers.
+
+DriverSupervisor owns one driver created by a factory and:
+- enforces a wall-clock deadline on every call; a call that overruns gets its chromedriver and
+  Chrome process tree killed (which unblocks the stuck WebDriver request) and a fresh driver,
+- recycles the driver after `recycle_after` calls or once the process tree uses more than
+  `max_rss_mb` MiB, so memory stays flat over long runs.
+
+psutil is optional: without it only chromedriver itself can be killed (Chrome usually follows
+when its parent dies) and the RSS limit is not enforced.
+"""
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class DriverHung(Exception):
+    """A supervised call overran its deadline; the driver was killed and replaced."""
+
+
+def driver_pid(driver):
+    """PID of the chromedriver process behind a Selenium driver, or None."""
+    process = getattr(getattr(driver, "service", None), "process", None)
+    return getattr(process, "pid", None)
+
+
+def _process_tree(pid):
+    if psutil is None or pid is None:
+        return []
+    try:
+        parent = psutil.Process(pid)
+        return [parent] + parent.children(recursive=True)
+    except psutil.Error:
+        return []
+
+
+def tree_rss_mb(pid):
+    """Resident memory of pid and all its descendants in MiB, or None when unknown."""
+    procs = _process_tree(pid)
+    if not procs:
+        return None
+    total = 0
+    for proc in procs:
+        try:
+            total += proc.memory_info().rss
+        except psutil.Error:
+            continue
+    return total / (1024 * 1024)
+
+
+def kill_driver(driver, procs=None):
+    """
+    Kill chromedriver and every browser process it spawned, without asking them nicely.
+    procs: process tree captured earlier (its root may already have exited).
+    """
+    if procs is None:
+        procs = _process_tree(driver_pid(driver))
+    if procs:
+        for proc in reversed(procs):
+            try:
+                proc.kill()
+            except psutil.Error:
+                pass
+        psutil.wait_procs(procs, timeout=5)
+        return
+    process = getattr(getattr(driver, "service", None), "process", None)
+    if process is not None:
+        try:
+            process.kill()
+        except Exception:
+            pass
+
+
+class _Deadline:
+    """
+    Deadline of the call in progress, watched by one long-lived thread: the tab multiplexer
+    makes a supervised call every poll, too often to start a Timer thread for each. The thread
+    exits after `idle` seconds with nothing armed.
+    """
+
+    def __init__(self, on_expire, idle=5.0):
+        self.on_expire = on_expire
+        self.idle = idle
+        self._cond = threading.Condition()
+        self._at = None
+        self._target = None
+        self._expired = False
+        self._thread = None
+
+    def arm(self, timeout, target):
+        with self._cond:
+            self._at = time.monotonic() + timeout
+            self._target = target
+            self._expired = False
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._watch, name="driver-deadline", daemon=True)
+                self._thread.start()
+            else:
+                self._cond.notify()
+
+    def disarm(self):
+        """Clear the deadline; True if it expired while armed."""
+        with self._cond:
+            self._at = None
+            self._target = None
+            return self._expired
+
+    def _watch(self):
+        with self._cond:
+            while True:
+                if self._at is None:
+                    if not self._cond.wait(self.idle) and self._at is None:
+                        self._thread = None
+                        return
+                    continue
+                remaining = self._at - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                target, self._at, self._target = self._target, None, None
+                self._expired = True
+                self._cond.release()
+                try:
+                    self.on_expire(target)
+                finally:
+                    self._cond.acquire()
+
+
+class DriverSupervisor:
+    """
+    factory: zero-argument callable returning a new driver.
+    call_timeout: seconds one call() may take before the driver is treated as hung.
+    recycle_after: replace the driver after this many calls (0 disables).
+    max_rss_mb: replace the driver when its process tree exceeds this (0 disables; needs psutil).
+    rss_check_interval: seconds between two RSS measurements (walking the process tree is not free).
+    """
+
+    def __init__(
+        self,
+        factory,
+        call_timeout=120,
+        recycle_after=300,
+        max_rss_mb=1500,
+        log_fn=print,
+        name="driver",
+        rss_check_interval=5.0,
+    ):
+        self.factory = factory
+        self.call_timeout = call_timeout
+        self.recycle_after = recycle_after
+        self.max_rss_mb = max_rss_mb
+        self.rss_check_interval = rss_check_interval
+        self.log_fn = log_fn
+        self.name = name
+        self.driver = None
+        self.calls = 0
+        self._rss_over = None
+        self._next_rss_check = 0.0
+        self._deadline = _Deadline(self._on_deadline)
+        self.start()
+
+    def start(self):
+        self.driver = self.factory()
+        self.calls = 0
+        self._rss_over = None
+        self._next_rss_check = 0.0
+
+    def stop(self):
+        driver, self.driver = self.driver, None
+        if driver is None:
+            return
+        # quit() itself can hang on a wedged browser: give it the same deadline, then kill
+        # whatever is left of the tree (including Chrome children orphaned by chromedriver)
+        procs = _process_tree(driver_pid(driver))
+        done = threading.Event()
+
+        def quit_driver():
+            try:
+                driver.quit()
+            except Exception:
+                pass
+            done.set()
+
+        threading.Thread(target=quit_driver, daemon=True).start()
+        if not done.wait(self.call_timeout):
+            self.log_fn(f"[{self.name}] driver.quit() không phản hồi, kill process.")
+            kill_driver(driver, procs)
+        elif procs:
+            kill_driver(driver, procs)
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def maybe_recycle(self):
+        """Replace the driver if it reached recycle_after calls or max_rss_mb. True if it did."""
+        if self.driver is None:
+            self.start()
+            return True
+        reason = self.recycle_reason()
+        if reason:
+            self.log_fn(f"[{self.name}] làm mới trình duyệt ({reason}).")
+            self.restart()
+        return bool(reason)
+
+    def recycle_reason(self):
+        """Why the driver is due for recycling, or None."""
+        if self.recycle_after and self.calls >= self.recycle_after:
+            return f"sau {self.calls} lượt tra"
+        if self.max_rss_mb and psutil is not None:
+            now = time.monotonic()
+            if now >= self._next_rss_check:
+                self._next_rss_check = now + self.rss_check_interval
+                rss = tree_rss_mb(driver_pid(self.driver))
+                self._rss_over = rss if rss is not None and rss > self.max_rss_mb else None
+            if self._rss_over is not None:
+                return f"RAM {self._rss_over:.0f} MiB > {self.max_rss_mb} MiB"
+        return None
+
+    def call(self, fn, *args, **kwargs):
+        """
+        One lookup: fn(driver, *args, **kwargs) under the deadline, counted towards
+        recycle_after. Recycles the driver first when due; raises DriverHung (after replacing
+        the driver) if the call overran.
+        """
+        self.maybe_recycle()
+        try:
+            return self.run(fn, *args, **kwargs)
+        finally:
+            self.calls += 1
+
+    def run(self, fn, *args, **kwargs):
+        """fn(driver, *args, **kwargs) under the deadline, without recycling or counting."""
+        if self.driver is None:
+            self.start()
+        driver = self.driver
+        self._deadline.arm(self.call_timeout, driver)
+        result = None
+        try:
+            result = fn(driver, *args, **kwargs)
+        except Exception:
+            # Errors caused by our own kill are reported as DriverHung below
+            if not self._deadline.disarm():
+                raise
+        finally:
+            expired = self._deadline.disarm()
+        if expired:
+            self.driver = None
+            try:
+                driver.quit()
+            except Exception:
+                pass
+            self.start()
+            raise DriverHung(f"call exceeded {self.call_timeout}s")
+        return result
+
+    def _on_deadline(self, driver):
+        self.log_fn(f"[{self.name}] treo quá {self.call_timeout}s, kill Chrome/chromedriver.")
+        kill_driver(driver)
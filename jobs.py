@@ -0,0 +1,156 @@
+"""
+Background lookup jobs for the Streamlit app.
+
+A lookup runs for minutes to hours. Running it inside a Streamlit script run blocks that
+session and dies with the page, so the app hands it to a JobManager (one per server process)
+instead. The manager runs each job on its own worker thread; the page only submits jobs and
+polls their state. A browser refresh, a second tab or another user can attach to a job again by
+its id.
+
+Jobs are threads rather than processes: run_lookup already spends its time waiting on the
+network or on Chrome subprocesses, and progress, log lines and the stop/pause events can be
+shared directly.
+"""
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+CANCELLING = "cancelling"
+DONE = "done"
+CANCELLED = "cancelled"
+FAILED = "failed"
+FINISHED = (DONE, CANCELLED, FAILED)
+
+
+class Job:
+    """
+    One run_lookup call and everything the page needs to show about it: status, progress,
+    the last `log_lines` log lines and the output path (rewritten during the run, so partial
+    results can be previewed).
+    """
+
+    def __init__(self, input_path, output_path, options, log_lines=500):
+        self.id = uuid.uuid4().hex[:8]
+        self.input_path = input_path
+        self.output_path = output_path
+        self.options = options
+        self.done = 0
+        self.total = 0
+        self.rate = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stop_event = threading.Event()
+        self.pause_event = threading.Event()
+        self._state = QUEUED
+        self._logs = deque(maxlen=log_lines)
+        self._lock = threading.Lock()
+
+    @property
+    def status(self):
+        if self._state == RUNNING:
+            if self.stop_event.is_set():
+                return CANCELLING
+            if self.pause_event.is_set():
+                return PAUSED
+        return self._state
+
+    @property
+    def finished(self):
+        return self._state in FINISHED
+
+    def log(self, msg):
+        with self._lock:
+            self._logs.append(f"{time.strftime('%H:%M:%S')} {msg}")
+
+    def logs(self, limit=200):
+        with self._lock:
+            return list(self._logs)[-limit:]
+
+    def clear_logs(self):
+        with self._lock:
+            self._logs.clear()
+
+    def update_progress(self, done, total, rate=None):
+        self.done, self.total, self.rate = done, total, rate
+
+    def pause(self):
+        self.pause_event.set()
+
+    def resume(self):
+        self.pause_event.clear()
+
+    def cancel(self):
+        """Stop after the lookups in flight; results so far are written out (or checkpointed)."""
+        self.stop_event.set()
+        self.pause_event.clear()
+
+
+class JobManager:
+    """
+    Runs jobs on up to `max_workers` threads (others wait as QUEUED) and keeps the last
+    `keep_finished` finished jobs so their results stay reachable.
+    """
+
+    def __init__(self, max_workers=2, keep_finished=50):
+        self.keep_finished = keep_finished
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, input_path, output_path, **options):
+        """Queue run_lookup(input_path, output_path, **options); returns the Job."""
+        job = Job(input_path, output_path, options)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """All known jobs, newest first."""
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    def _run(self, job):
+        if job.stop_event.is_set():
+            job._state = CANCELLED
+            job.finished_at = time.time()
+            return
+        job._state = RUNNING
+        job.started_at = time.time()
+        try:
+            from save_code import run_lookup
+
+            run_lookup(
+                job.input_path,
+                job.output_path,
+                log_fn=job.log,
+                progress_fn=job.update_progress,
+                stop_event=job.stop_event,
+                pause_event=job.pause_event,
+                **job.options,
+            )
+            job._state = CANCELLED if job.stop_event.is_set() else DONE
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+            job.log(traceback.format_exc())
+            job._state = FAILED
+        finally:
+            job.finished_at = time.time()
@@ -0,0 +1,83 @@
+"""
+Structured lookup statuses.
+
+Each Status is a str whose value is the human label written to the Excel 'Trạng thái'
+column, so it can be stored and compared like the old free-form strings, while `code` and
+`kind` give a stable machine-readable classification:
+
+    success   - MST found
+    terminal  - the site's search list answered, there is nothing to find (re-checked only by policy)
+    transient - timeout / blocked / unrecognised page / interaction or system error, worth retrying
+"""
+from enum import Enum
+
+SUCCESS = "success"
+TERMINAL = "terminal"
+TRANSIENT = "transient"
+
+
+class Status(str, Enum):
+    SUCCESS = "thành công"
+    NOT_FOUND_LIST = "không tìm thấy (dạng danh sách)"
+    NOT_FOUND_DETAIL = "không tìm thấy thông tin chi tiết"  # legacy label of UNKNOWN_PAGE
+    UNKNOWN_PAGE = "lỗi: không nhận dạng được trang kết quả"
+    INVALID_CCCD = "CCCD không hợp lệ"
+    TIMEOUT = "kết nối thất bại/timeout"
+    BLOCKED = "lỗi: bị chặn/captcha"
+    AD_TIMEOUT = "lỗi: quá thời gian chờ tắt quảng cáo"
+    INTERACTION_ERROR = "lỗi tương tác search"
+    SYSTEM_ERROR = "lỗi hệ thống"
+
+    __str__ = str.__str__
+
+    @property
+    def code(self):
+        return self.name.lower()
+
+    @property
+    def label(self):
+        return self.value
+
+    @property
+    def kind(self):
+        if self is Status.SUCCESS:
+            return SUCCESS
+        # Not NOT_FOUND_DETAIL: older versions wrote it for any page they did not recognise
+        if self in (Status.NOT_FOUND_LIST, Status.INVALID_CCCD):
+            return TERMINAL
+        return TRANSIENT
+
+
+_BY_LABEL = {status.value.lower(): status for status in Status}
+_BY_CODE = {status.code: status for status in Status}
+
+
+def parse_status(value):
+    """Status for a label (any case) or code, else None (empty / never looked up / unknown text)."""
+    if isinstance(value, Status):
+        return value
+    key = str(value).strip().lower()
+    return _BY_LABEL.get(key) or _BY_CODE.get(key)
+
+
+def status_kind(value):
+    """
+    success / terminal / transient for a Status or a label, including labels written by older
+    versions ('lỗi ...' and 'kết nối ...' are transient, 'không tìm thấy ...' terminal).
+    None for empty or unrecognised values.
+    """
+    status = parse_status(value)
+    if status is not None:
+        return status.kind
+    text = str(value).strip().lower()
+    if text.startswith("lỗi") or "kết nối" in text:
+        return TRANSIENT
+    if "không tìm thấy" in text:
+        return TERMINAL
+    return None
+
+
+def status_kinds(values):
+    """status_kind for a whole pandas column, evaluated once per distinct value."""
+    kinds = {value: status_kind(value) for value in values.unique()}
+    return values.map(kinds)
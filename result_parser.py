@@ -0,0 +1,101 @@
+"""
+Offline parser for masothue.com result pages.
+
+Shared by the HTTP engine (response body), the Selenium engine (page_source fallback) and
+failure dumps (page_dump*.html), so extraction can be profiled and checked without a browser:
+
+    python result_parser.py page_dump.html fixtures/*.html
+"""
+import sys
+from typing import NamedTuple
+
+# Markers of anti-bot / rate-limit interstitials (the normal pages carry none of these)
+BLOCKED_MARKERS = (
+    "cf-chl-",
+    "challenge-platform",
+    "cf-turnstile",
+    "g-recaptcha",
+    "h-captcha",
+    "Just a moment...",
+    "Attention Required!",
+    "Too Many Requests",
+)
+
+# page_type values
+DETAIL = "detail"      # MST found
+LIST = "list"          # search result listing, no single match
+BLOCKED = "blocked"    # anti-bot / captcha page
+UNKNOWN = "unknown"    # loaded but not recognised
+
+
+class LookupResult(NamedTuple):
+    page_type: str
+    mst: str = ""
+    name: str = ""
+    representative: str = ""
+    url: str = ""
+
+
+def looks_blocked(page_html):
+    return any(marker in page_html for marker in BLOCKED_MARKERS)
+
+
+def _text(node):
+    return node.text_content().strip() if node is not None else ""
+
+
+def _first(nodes):
+    return nodes[0] if nodes else None
+
+
+def _cell_after_label(doc, label):
+    return _text(_first(doc.xpath("//td[contains(., $label)]/following-sibling::td[1]", label=label)))
+
+
+def parse_result_page(page_html, url=""):
+    """
+    Parse a result page (str or bytes) into a LookupResult.
+    url: final URL of the page if known; falls back to <link rel="canonical">.
+    """
+    if isinstance(page_html, bytes):
+        text = page_html.decode("utf-8", errors="replace")
+    else:
+        text = page_html
+    if not text.strip():
+        return LookupResult(UNKNOWN, url=url)
+
+    # Imported on first use so the Selenium path and plain imports don't pay for lxml
+    from lxml import html as lxml_html
+
+    doc = lxml_html.fromstring(page_html)
+    if not url:
+        url = _first(doc.xpath("//link[@rel='canonical']/@href")) or ""
+
+    # 1. Name from H1 ("<cccd> - <name>")
+    h1 = _first(doc.xpath("//h1"))
+    h1_text = _text(h1)
+    name = h1_text.split(" - ", 1)[1].strip() if " - " in h1_text else ""
+
+    # 2. MST and representative from the detail table, with itemprop fallbacks
+    mst = _cell_after_label(doc, "Mã số thuế") or _text(_first(doc.xpath("//*[@itemprop='taxID']")))
+    representative = _cell_after_label(doc, "Người đại diện")
+    if not name:
+        name = representative or _text(_first(doc.xpath("//*[@itemprop='name']")))
+
+    if mst:
+        return LookupResult(DETAIL, mst, name, representative, url)
+    if looks_blocked(text):
+        return LookupResult(BLOCKED, url=url)
+    if "Search" in url:
+        return LookupResult(LIST, url=url)
+    return LookupResult(UNKNOWN, url=url)
+
+
+def main(paths):
+    for path in paths:
+        with open(path, "rb") as f:
+            print(f"{path}: {parse_result_page(f.read())}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
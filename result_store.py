@@ -0,0 +1,253 @@
+"""
+Durable storage for lookup results.
+
+ResultJournal: append-only JSONL written during a run, so each processed row costs one small
+append instead of re-serialising the whole workbook.
+ResultCache: SQLite CCCD -> result cache shared across runs and input files.
+RunCheckpoint: small JSON file describing how far an interrupted run got.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+DAY = 24 * 3600
+
+
+class ResultJournal:
+    """
+    Append-only JSONL journal of lookup results.
+
+    Every record is flushed to the OS immediately (survives a process crash, like the old
+    per-row to_excel), and fsync'd every `sync_every` records (survives power loss up to
+    the last batch).
+    """
+
+    def __init__(self, path, sync_every=50):
+        self.path = path
+        self.sync_every = max(1, int(sync_every))
+        self._unsynced = 0
+        self._file = open(path, "a", encoding="utf-8")
+
+    def append(self, index, cccd, status, mst, name, checks=0, checked_at=""):
+        record = {
+            "index": int(index),
+            "cccd": cccd,
+            "status": str(status),
+            "mst": mst,
+            "name": name,
+            "checks": checks,
+            "checked_at": checked_at,
+            "ts": time.time(),
+        }
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        if self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    @staticmethod
+    def replay(path):
+        """Yield records from an existing journal, skipping a torn last line from a crash."""
+        if not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+class ResultCache:
+    """
+    Persistent CCCD -> (status, mst, name) cache backed by SQLite.
+
+    Positive results (MST found) and negative ones (not found) expire after their own TTL;
+    errors are never stored. When the table grows past `max_entries`, the oldest rows are
+    evicted. Safe to share between threads (the input reader looks up, the event loop stores).
+    Every put commits at once, so several runs/processes can share one file; a writer waits up
+    to `busy_timeout` seconds for another's transaction.
+    """
+
+    def __init__(self, path, positive_ttl=30 * DAY, negative_ttl=7 * DAY, max_entries=500_000, busy_timeout=10.0):
+        self.path = path
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._puts = 0
+        self._lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # Other processes/jobs may share the file: wait for their short write transactions
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS lookups (
+                cccd TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                mst TEXT NOT NULL,
+                name TEXT NOT NULL,
+                positive INTEGER NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS lookups_fetched_at ON lookups (fetched_at)")
+        self._conn.commit()
+
+    def _fresh(self, positive, fetched_at, now):
+        ttl = self.positive_ttl if positive else self.negative_ttl
+        return now - fetched_at <= ttl
+
+    def get(self, cccd, now=None):
+        """(status, mst, name, fetched_at) for a fresh entry, else None."""
+        return self.get_many([cccd], now=now).get(cccd)
+
+    def get_many(self, cccds, now=None):
+        """{cccd: (status, mst, name, fetched_at)} for every fresh entry among cccds."""
+        now = time.time() if now is None else now
+        found = {}
+        keys = list(dict.fromkeys(cccds))
+        # Stay well below SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT cccd, status, mst, name, positive, fetched_at FROM lookups WHERE cccd IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+            for cccd, status, mst, name, positive, fetched_at in rows:
+                if self._fresh(positive, fetched_at, now):
+                    found[cccd] = (status, mst, name, fetched_at)
+        return found
+
+    def put(self, cccd, status, mst, name, positive, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._put(cccd, status, mst, name, positive, now)
+
+    def _put(self, cccd, status, mst, name, positive, now):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO lookups (cccd, status, mst, name, positive, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (cccd, status, mst, name, int(bool(positive)), now),
+        )
+        # Commit right away (cheap in WAL mode) so the write lock is never held between puts
+        self._conn.commit()
+        self._puts += 1
+        if self._puts % 1000 == 0:
+            self._evict(now)
+
+    def evict(self, now=None):
+        """Drop expired entries, then the oldest ones above max_entries."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._evict(now)
+
+    def _evict(self, now):
+        self._conn.execute(
+            "DELETE FROM lookups WHERE (positive = 1 AND fetched_at < ?) OR (positive = 0 AND fetched_at < ?)",
+            (now - self.positive_ttl, now - self.negative_ttl),
+        )
+        if self.max_entries:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM lookups").fetchone()
+            excess = count - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM lookups WHERE cccd IN (SELECT cccd FROM lookups ORDER BY fetched_at LIMIT ?)",
+                    (excess,),
+                )
+        self._conn.commit()
+
+    def close(self):
+        try:
+            self.evict()
+        except sqlite3.Error:
+            pass  # eviction can wait for the next run
+        finally:
+            self._conn.close()
+
+
+def file_fingerprint(path):
+    """[size, mtime_ns] of path, or None if it is missing."""
+    if not path:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def new_run_id():
+    import uuid
+
+    return time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+
+
+class RunCheckpoint:
+    """
+    Resume point of a run, rewritten atomically (temp file + fsync + os.replace), so a crash
+    leaves either the previous checkpoint or the new one, never a torn file:
+
+        run_id       id of the run, kept across restarts
+        source       table being processed and its fingerprint ([size, mtime_ns])
+        cursor       rows [0, cursor) are final and stored in the spool file ...
+        spool_size   ... whose first spool_size bytes hold exactly those rows
+        attempts     {cccd: lookups made} of rows waiting for a retry
+        rate, limit  rate controller state (req/s, concurrency)
+
+    Rows from cursor on come back from the source plus the result journal.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """The saved state, or None when missing or unreadable."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return state if isinstance(state, dict) and state.get("run_id") else None
+
+    def save(self, state):
+        folder = os.path.dirname(self.path) or "."
+        state = dict(state, updated_at=time.time())
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".checkpoint_", suffix=".json")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,129 @@
+"""
+Compact in-memory form of the lookup table, one window (input chunk) at a time.
+
+A chunk read as a DataFrame of Python strings costs well over 100 bytes per cell. While its
+lookups are running, a window keeps instead:
+
+    CCCD          fixed-width bytes (12 per row); the rare value that is not 0-12 digits is
+                  kept aside as text
+    Trạng thái    int32 code into a Categories table shared by all windows of the run
+    Số lần tra    int16 (-1 for blank)
+    Ngày tra      int32 code into another Categories table (one run stamps many rows alike)
+    MST, Tên      object arrays (mostly the shared '' until a lookup fills them)
+
+Other input columns are carried through untouched. Values are decoded back to strings only
+by to_frame(), when the window is written out.
+"""
+import threading
+
+CCCD_COL = 'CCCD'
+MST_COL = 'MST'
+NAME_COL = 'Tên'
+STATUS_COL = 'Trạng thái'
+CHECKS_COL = 'Số lần tra'
+CHECKED_AT_COL = 'Ngày tra'
+
+_CCCD_WIDTH = 12
+
+
+class Categories:
+    """Thread-safe label <-> int code table; code 0 is ''."""
+
+    def __init__(self):
+        self.labels = [""]
+        self._codes = {"": 0}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def code(self, label):
+        label = str(label)
+        code = self._codes.get(label)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(label)
+                if code is None:
+                    code = self._codes[label] = len(self.labels)
+                    self.labels.append(label)
+        return code
+
+    def encode(self, values):
+        """int32 codes for a Series of labels."""
+        import numpy as np
+        import pandas as pd
+
+        local_codes, uniques = pd.factorize(values.astype(str), sort=False)
+        table = np.array([self.code(label) for label in uniques], dtype=np.int32)
+        return table[local_codes] if len(table) else np.zeros(len(values), dtype=np.int32)
+
+    def decode(self, codes):
+        import numpy as np
+
+        return np.asarray(self.labels, dtype=object)[codes]
+
+
+class RowWindow:
+    """
+    Rows [start, start + size) of the table. `pending` counts rows still waiting for a lookup;
+    the window can be written out and dropped once it reaches 0.
+    """
+
+    def __init__(self, frame, statuses, timestamps, pending=0):
+        import numpy as np
+        import pandas as pd
+
+        self.statuses = statuses
+        self.timestamps = timestamps
+        self.start = int(frame.index[0]) if len(frame) else 0
+        self.size = len(frame)
+        self.pending = pending
+        self.columns = list(frame.columns)
+
+        cccd = frame[CCCD_COL].astype(str)
+        compact = cccd.str.fullmatch(r"\d{0,%d}" % _CCCD_WIDTH).to_numpy(dtype=bool)
+        self.cccd = np.zeros(self.size, dtype=f"S{_CCCD_WIDTH}")
+        self.cccd[compact] = cccd.to_numpy(dtype=object)[compact].astype(f"S{_CCCD_WIDTH}")
+        self.cccd_text = {int(i): cccd.iat[i] for i in np.flatnonzero(~compact)}
+
+        self.mst = frame[MST_COL].to_numpy(dtype=object).copy()
+        self.name = frame[NAME_COL].to_numpy(dtype=object).copy()
+        self.status = statuses.encode(frame[STATUS_COL].astype(str).str.strip())
+        checks = pd.to_numeric(frame[CHECKS_COL], errors='coerce')
+        self.checks = checks.fillna(-1).clip(-1, np.iinfo(np.int16).max).to_numpy(dtype=np.int16)
+        self.checked_at = timestamps.encode(frame[CHECKED_AT_COL])
+
+        known = {CCCD_COL, MST_COL, NAME_COL, STATUS_COL, CHECKS_COL, CHECKED_AT_COL}
+        self.extra = frame[[col for col in self.columns if col not in known]].reset_index(drop=True)
+
+    def checks_of(self, index):
+        return max(0, int(self.checks[index - self.start]))
+
+    def set_result(self, index, status, mst, name, checks, checked_at):
+        i = index - self.start
+        self.mst[i] = mst
+        self.name[i] = name
+        self.status[i] = self.statuses.code(status)
+        self.checks[i] = checks
+        self.checked_at[i] = self.timestamps.code(checked_at)
+
+    def to_frame(self):
+        """Decode into a str DataFrame with the input's columns and global index."""
+        import numpy as np
+        import pandas as pd
+
+        cccd = self.cccd.astype(f"U{_CCCD_WIDTH}").astype(object)
+        for i, text in self.cccd_text.items():
+            cccd[i] = text
+        checks = np.where(self.checks >= 0, self.checks.astype(str), "").astype(object)
+        decoded = {
+            CCCD_COL: cccd,
+            MST_COL: self.mst,
+            NAME_COL: self.name,
+            STATUS_COL: self.statuses.decode(self.status),
+            CHECKS_COL: checks,
+            CHECKED_AT_COL: self.timestamps.decode(self.checked_at),
+        }
+        index = pd.RangeIndex(self.start, self.start + self.size)
+        data = {col: decoded[col] if col in decoded else self.extra[col].to_numpy() for col in self.columns}
+        return pd.DataFrame(data, index=index, columns=self.columns)
@@ -1,42 +1,66 @@
-import pandas as pd
+# Heavy dependencies (pandas, selenium, requests, lxml, asyncio) are imported inside the functions
+# that need them, so importing this module (every Streamlit rerun, HTTP-only runs) stays cheap.
 import time
 import os
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.keys import Keys
-from selenium.common.exceptions import StaleElementReferenceException
-
-try:
-    from webdriver_manager.chrome import ChromeDriverManager
-    from webdriver_manager.core.utils import ChromeType
-except ImportError:
-    print("Please install webdriver_manager: pip install webdriver-manager")
-    exit(1)
+import queue
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from result_parser import (
+    BLOCKED,
+    BLOCKED_MARKERS,
+    DETAIL,
+    LIST,
+    LookupResult,
+    looks_blocked,
+    parse_result_page,
+)
+from lookup_status import SUCCESS, TERMINAL, TRANSIENT, Status, status_kind, status_kinds
+from browser_state import BrowserState
+from chrome_paths import resolve_chrome_paths
+from driver_supervisor import DriverHung, DriverSupervisor
+from result_store import DAY, ResultCache, ResultJournal, RunCheckpoint, file_fingerprint, new_run_id
+from row_window import CHECKED_AT_COL, CHECKS_COL
+from table_io import DEFAULT_CHUNK_SIZE, CsvSpool, detect_format, iter_chunks, output_format_for, write_table
 
 import sys
 import io
 
-# Force UTF-8 encoding for stdout/stderr to handle Vietnamese characters
-# Guard against environments where stdout/stderr don't expose .buffer (Streamlit Cloud wrappers)
-try:
-    if hasattr(sys.stdout, "buffer"):
-        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
-    if hasattr(sys.stderr, "buffer"):
-        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf-8")
-except Exception:
-    pass  # Best effort; don't crash app on logging setup
-
-# Logging check (fallback to console if file cannot be opened)
 log_file = None
-try:
-    log_file = open("lookup.log", "w", encoding="utf-8")
-except Exception:
-    log_file = None
+_logging_ready = False
+_logging_lock = threading.Lock()
+
+def _setup_logging():
+    """Console/lookup.log setup, done on the first log() call instead of at import time."""
+    global log_file, _logging_ready
+    with _logging_lock:
+        if _logging_ready:
+            return
+        _logging_ready = True
+        # Force UTF-8 encoding for stdout/stderr to handle Vietnamese characters
+        # Guard against environments where stdout/stderr don't expose .buffer (Streamlit Cloud wrappers)
+        try:
+            if hasattr(sys.stdout, "buffer"):
+                sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+            if hasattr(sys.stderr, "buffer"):
+                sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf-8")
+        except Exception:
+            pass  # Best effort; don't crash app on logging setup
+
+        # Logging check (fallback to console if file cannot be opened)
+        try:
+            # Append: every job of a server process (and every resumed run) keeps earlier logs
+            log_file = open("lookup.log", "a", encoding="utf-8")
+        except Exception:
+            log_file = None
 
 def log(msg):
+    if not _logging_ready:
+        _setup_logging()
     print(msg)
     if log_file:
         log_file.write(str(msg) + "\n")
@@ -45,11 +69,43 @@ def log(msg):
 # Configuration (allow override via env vars)
 INPUT_FILE = os.getenv("INPUT_FILE", "data/data.xlsx")
 OUTPUT_FILE = os.getenv("OUTPUT_FILE", "result/result5.xlsx")
+CACHE_FILE = os.getenv("CACHE_FILE", "result/lookup_cache.sqlite")
+BROWSER_STATE_FILE = os.getenv("BROWSER_STATE_FILE", "result/browser_state.json")
+# Optional persistent Chrome profiles (one sub-folder per worker); temp profiles when unset
+CHROME_PROFILE_DIR = os.getenv("CHROME_PROFILE_DIR") or None
+
+# Plain GET search endpoint (same target as the site's SearchAction / <form action="/Search/">)
+SEARCH_URL = "https://masothue.com/Search/"
+HTTP_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "vi-VN,vi;q=0.9,en;q=0.8",
+}
+
+BLOCKED_HTTP_CODES = {403, 429, 503}
+
+def result_status(result):
+    """Map a parsed LookupResult to the (Status, mst, name) triple written to Excel."""
+    if result.page_type == DETAIL:
+        return Status.SUCCESS, result.mst, result.name
+    if result.page_type == LIST:
+        return Status.NOT_FOUND_LIST, "", ""
+    if result.page_type == BLOCKED:
+        return Status.BLOCKED, "", ""
+    # Layout change, half-loaded page, homepage...: retry, never a "not found"
+    return Status.UNKNOWN_PAGE, "", ""
 
 # ---------- Small Selenium helpers to reduce stale-element errors ----------
 
 def safe_click(driver, locator, retries=3, timeout=10):
     """Click an element; if it goes stale, re-locate and retry."""
+    from selenium.common.exceptions import StaleElementReferenceException
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
     for _ in range(retries):
         try:
             el = WebDriverWait(driver, timeout).until(EC.element_to_be_clickable(locator))
@@ -60,10 +116,15 @@ def safe_click(driver, locator, retries=3, timeout=10):
     raise RuntimeError("element stayed stale after retries")
 
 def wait_for_presence(driver, locator, timeout=10):
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
     return WebDriverWait(driver, timeout).until(EC.presence_of_element_located(locator))
 
 def dismiss_popups(driver):
     """Best-effort close common ad/consent overlays so search box becomes clickable."""
+    from selenium.webdriver.common.by import By
+
     selectors = [
         "button[aria-label='Close']",
         "button.close",
@@ -82,7 +143,67 @@ def dismiss_popups(driver):
             continue
     return False
 
-def init_driver(headless=False):
+# Third-party ads/trackers/fonts and heavy static assets that the lookup never needs
+# (seen preconnected/loaded on every result page, cf. page_dump.html)
+BLOCKED_URL_PATTERNS = [
+    "*googlesyndication.com*",
+    "*doubleclick.net*",
+    "*googletagmanager.com*",
+    "*google-analytics.com*",
+    "*googleadservices.com*",
+    "*adservice.google.*",
+    "*fundingchoicesmessages.google.com*",
+    "*cloudflareinsights.com*",
+    "*facebook.com*",
+    "*facebook.net*",
+    "*zalo.me*",
+    "*fonts.googleapis.com*",
+    "*fonts.gstatic.com*",
+    "*.woff*",
+    "*.ttf*",
+    "*.png*",
+    "*.jpg*",
+    "*.jpeg*",
+    "*.gif*",
+    "*.webp*",
+    "*.svg*",
+    "*.ico*",
+]
+
+def _apply_resource_blocking(options):
+    """Return after DOMContentLoaded and never fetch images."""
+    options.page_load_strategy = 'eager'
+    options.add_argument('--blink-settings=imagesEnabled=false')
+    options.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,
+    })
+
+def _block_urls(driver):
+    """Drop ad/tracker/font/image requests at the network layer via DevTools."""
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+    except Exception as e:
+        log(f"Could not enable URL blocking: {e}")
+
+def init_driver(
+    headless=False,
+    debug_port=0,
+    user_data_dir=None,
+    block_resources=False,
+    page_load_timeout=30,
+    script_timeout=10,
+):
+    """
+    Start Chrome. debug_port 0 lets Chrome pick a free port, so any number of drivers (several
+    workers, several jobs in one process) can run side by side; user_data_dir must be unique.
+    block_resources: eager page loads, no images, and ads/trackers/fonts blocked via DevTools.
+    page_load_timeout/script_timeout: seconds before driver.get()/execute_script() give up
+    instead of waiting forever on a page that never finishes loading.
+    """
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+
     options = webdriver.ChromeOptions()
     if headless:
         options.add_argument('--headless=new')
@@ -90,190 +211,989 @@ def init_driver(headless=False):
     options.add_argument('--disable-dev-shm-usage')
     options.add_argument('--disable-gpu')
     options.add_argument('--disable-software-rasterizer')
-    options.add_argument('--remote-debugging-port=9222')  # reduce DevToolsActivePort errors in containers
-
-    # Support Streamlit Cloud/containers where Chrome is at a custom path
-    chrome_bin_candidates = [
-        os.getenv("CHROME_BIN"),
-        "/usr/bin/chromium",            # debian/ubuntu chromium package
-        "/usr/bin/chromium-browser",    # older ubuntu
-        "/usr/lib/chromium/chrome",     # some alpine builds
-        "/usr/bin/google-chrome",
-        "/usr/bin/google-chrome-stable",
-    ]
-
-    chosen_bin = None
-    for candidate in chrome_bin_candidates:
-        if candidate and os.path.exists(candidate):
-            chosen_bin = candidate
-            break
+    options.add_argument(f'--remote-debugging-port={debug_port}')  # reduce DevToolsActivePort errors in containers
+    if user_data_dir:
+        options.add_argument(f'--user-data-dir={user_data_dir}')
+    if block_resources:
+        _apply_resource_blocking(options)
 
+    # Probed (and downloaded if needed) once, then served from memory / result/chrome_paths.json
+    chosen_bin, driver_path = resolve_chrome_paths(log_fn=log)
     if chosen_bin:
-        log(f"Using Chrome binary at {chosen_bin}")
         options.binary_location = chosen_bin
-    else:
-        log("Chrome binary not found. Set CHROME_BIN to a valid path.")
-
-    driver_path = None
-    env_driver = os.getenv("CHROMEDRIVER_PATH")
-    if env_driver and os.path.exists(env_driver):
-        driver_path = env_driver
-    elif os.path.exists("/usr/bin/chromedriver"):
-        driver_path = "/usr/bin/chromedriver"
-    else:
-        # Download a Chromium-compatible driver to avoid version mismatch
-        driver_path = ChromeDriverManager(chrome_type=ChromeType.CHROMIUM).install()
-
-    log(f"Using ChromeDriver at {driver_path}")
     service = Service(driver_path)
 
     driver = webdriver.Chrome(service=service, options=options)
+    driver.set_page_load_timeout(page_load_timeout)
+    driver.set_script_timeout(script_timeout)
+    if block_resources:
+        _block_urls(driver)
     return driver
 
-def lookup_mst(driver, cccd, log_fn=log):
-    log_fn(f"Looking up MST for CCCD: {cccd}")
+# Runs inside the page and returns every LookupResult field as one JSON object, so a
+# result costs a single chromedriver call instead of one find_element per field.
+# Mirrors result_parser.parse_result_page; page_type is null while the h1 has not rendered yet.
+_EXTRACT_JS = """
+if (window.__mstPending) return null;  // TabMultiplexer: navigation requested, old page still shown
+const markers = arguments[0];
+const text = (el) => (el ? (el.innerText || el.textContent || "").trim() : "");
+const cellAfter = (label) => {
+    for (const td of document.querySelectorAll("td")) {
+        if (td.textContent.includes(label)) {
+            let next = td.nextElementSibling;
+            while (next && next.tagName !== "TD") next = next.nextElementSibling;
+            if (next) return text(next);
+        }
+    }
+    return "";
+};
+const h1 = document.querySelector("h1");
+// Only asked when there is no MST, and without serialising the page: interstitials name
+// themselves in the title/heading, challenge widgets in class/id/src/action attributes
+const looksBlocked = () => {
+    const heading = document.title + " " + text(h1);
+    if (markers.some((m) => heading.includes(m))) return true;
+    const selector = markers
+        .flatMap((m) => ["class", "id", "src", "action"].map((attr) => `[${attr}*=${JSON.stringify(m)}]`))
+        .join(",");
+    return document.querySelector(selector) !== null;
+};
+const h1Text = text(h1);
+const result = {
+    page_type: null,
+    mst: cellAfter("Mã số thuế") || text(document.querySelector("[itemprop='taxID']")),
+    name: h1Text.includes(" - ") ? h1Text.split(" - ").slice(1).join(" - ").trim() : "",
+    representative: cellAfter("Người đại diện"),
+    url: window.location.href,
+};
+if (!result.name) result.name = result.representative || text(document.querySelector("[itemprop='name']"));
+if (result.mst) result.page_type = "detail";
+else if (looksBlocked()) result.page_type = "blocked";
+else if (!h1) result.page_type = null;
+else if (result.url.includes("Search")) result.page_type = "list";
+else result.page_type = "unknown";
+if (result.page_type !== "detail") Object.assign(result, {mst: "", name: "", representative: ""});
+return result;
+"""
+
+def _extract_in_page(driver):
+    """
+    One round trip: LookupResult from _EXTRACT_JS, or None while the result page is still loading.
+    If the script itself fails, parse page_source offline instead.
+    """
+    from selenium.common.exceptions import JavascriptException
+
+    try:
+        data = driver.execute_script(_EXTRACT_JS, list(BLOCKED_MARKERS))
+    except JavascriptException:
+        result = parse_result_page(driver.page_source, url=driver.current_url)
+        return result if result.page_type in (DETAIL, LIST, BLOCKED) else None
+    if not data or not data.get("page_type"):
+        return None
+    return LookupResult(**data)
+
+def _submit_search_form(driver, cccd, log_fn=log):
+    """
+    Legacy flow: open the homepage, wait out ads/consent, type the CCCD and submit.
+    Returns None on success, or an error status.
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    driver.get("https://masothue.com")
+    
+    # Wait loop for search box to be ready (attempt to auto-close ads/consent)
+    search_box = None
+    max_retries = 30 # Wait up to 60 seconds (30 * 2s)
     
+    for i in range(max_retries):
+        try:
+            dismiss_popups(driver)
+            # Try to find and click the search box
+            wait = WebDriverWait(driver, 2)
+            search_box = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "input[name='q']")))
+            search_box.click() # Test interaction
+            log_fn("Search box is ready.")
+            break
+        except Exception:
+            log_fn(f"Waiting for ads to be closed/search box to be ready... ({i+1}/{max_retries})")
+            if (i + 1) % 10 == 0:
+                driver.refresh()
+            time.sleep(2)
+            
+    if not search_box:
+        return Status.AD_TIMEOUT
+
+    # Interaction with search box (robust against staleness)
+    search_box_locator = (By.CSS_SELECTOR, "input[name='q']")
+    search_btn_locator = (By.CSS_SELECTOR, "button.search-btn, button[type='submit']")
+
     try:
-        driver.get("https://masothue.com")
-        
-        # Wait loop for search box to be ready (attempt to auto-close ads/consent)
-        search_box = None
-        max_retries = 30 # Wait up to 60 seconds (30 * 2s)
-        
-        for i in range(max_retries):
-            try:
-                dismiss_popups(driver)
-                # Try to find and click the search box
-                wait = WebDriverWait(driver, 2)
-                search_box = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, "input[name='q']")))
-                search_box.click() # Test interaction
-                log_fn("Search box is ready.")
-                break
-            except Exception:
-                log_fn(f"Waiting for ads to be closed/search box to be ready... ({i+1}/{max_retries})")
-                if (i + 1) % 10 == 0:
-                    driver.refresh()
-                time.sleep(2)
-                
-        if not search_box:
-            return "lỗi: quá thời gian chờ tắt quảng cáo", "", ""
-
-        # Interaction with search box (robust against staleness)
-        search_box_locator = (By.CSS_SELECTOR, "input[name='q']")
-        search_btn_locator = (By.CSS_SELECTOR, "button.search-btn, button[type='submit']")
+        box = wait_for_presence(driver, search_box_locator)
+        box.clear()
+        box.send_keys(cccd)
+        time.sleep(0.5)
+
+        try:
+            safe_click(driver, search_btn_locator)
+            log_fn("Clicked search button.")
+        except Exception:
+            log_fn("Search button not found, using Enter key.")
+            box = wait_for_presence(driver, search_box_locator)
+            box.send_keys(Keys.RETURN)
+
+        log_fn(f"Current URL after submit: {driver.current_url}")
 
+    except Exception as e:
+        log_fn(f"Standard interaction failed: {e}. Trying JS fallback.")
         try:
             box = wait_for_presence(driver, search_box_locator)
-            box.clear()
+            driver.execute_script("arguments[0].value = '';", box)
             box.send_keys(cccd)
-            time.sleep(0.5)
+            safe_click(driver, search_btn_locator)
+        except Exception as js_e:
+            log_fn(f"JS fallback also failed: {js_e}")
+            return Status.INTERACTION_ERROR
 
-            try:
-                safe_click(driver, search_btn_locator)
-                log_fn("Clicked search button.")
-            except Exception:
-                log_fn("Search button not found, using Enter key.")
-                box = wait_for_presence(driver, search_box_locator)
-                box.send_keys(Keys.RETURN)
+    return None
+
+def _wait_for_result(driver, timeout=10):
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    return WebDriverWait(driver, timeout).until(lambda d: _extract_in_page(d) or False)
+
+def _search_url(cccd):
+    return f"{SEARCH_URL}?{urlencode({'type': 'auto', 'q': cccd})}"
+
+def _open_search_url(driver, cccd, log_fn=log, timeout=10):
+    """
+    Load /Search/?type=auto&q=<cccd> in a single driver.get.
+    Returns the extracted page data, or None if the page never became readable.
+    """
+    try:
+        driver.get(_search_url(cccd))
+        return _wait_for_result(driver, timeout=timeout)
+    except Exception as e:
+        log_fn(f"Direct search URL failed: {e}. Falling back to the search form.")
+        return None
 
-            log_fn(f"Current URL after submit: {driver.current_url}")
+def lookup_mst(driver, cccd, log_fn=log, direct=True):
+    """
+    Tra cứu bằng Selenium. direct=True: mở thẳng URL tìm kiếm, chỉ dùng form trang chủ khi thất bại.
+    """
+    log_fn(f"Looking up MST for CCCD: {cccd}")
+    
+    try:
+        data = _open_search_url(driver, cccd, log_fn=log_fn) if direct else None
+        if data is None:
+            error = _submit_search_form(driver, cccd, log_fn=log_fn)
+            if error:
+                return error, "", ""
+
+        # Wait for results and extract everything in one execute_script round trip per poll
+        try:
+            result = data if data is not None else _wait_for_result(driver)
+            if result.page_type in (DETAIL, LIST):
+                return result_status(result)
+            if result.page_type == BLOCKED:
+                log_fn("Blocked/captcha page detected.")
+                return result_status(result)
+
+            with open("page_dump.html", "w", encoding="utf-8") as f:
+                f.write(driver.page_source)
+            log_fn("Dumped page source to page_dump.html due to failure.")
+            return Status.UNKNOWN_PAGE, "", ""
 
         except Exception as e:
-            log_fn(f"Standard interaction failed: {e}. Trying JS fallback.")
+            log_fn(f"Timeout or parsed error: {e}")
+            page_source = driver.page_source
+            with open("page_dump_error.html", "w", encoding="utf-8") as f:
+                f.write(page_source)
+            if looks_blocked(page_source):
+                log_fn("Blocked/captcha page detected.")
+                return Status.BLOCKED, "", ""
+            return Status.TIMEOUT, "", ""
+
+    except Exception as e:
+        log_fn(f"Error looking up {cccd}: {e}")
+        return Status.SYSTEM_ERROR, "", ""
+
+# ---------- Browserless HTTP engine ----------
+
+def init_session(pool_size=4, browser_state=None):
+    """
+    Keep-alive HTTP session reused for every lookup (no Chrome needed).
+    browser_state: BrowserState whose cookies seed the cookie jar.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    session.headers.update(HTTP_HEADERS)
+    if browser_state:
+        browser_state.apply_to_session(session)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def lookup_mst_http(session, cccd, log_fn=log, timeout=15):
+    """Same contract as lookup_mst, but via GET /Search/?type=auto&q=... instead of Chrome."""
+    import requests
+
+    log_fn(f"Looking up MST for CCCD (http): {cccd}")
+
+    try:
+        resp = session.get(SEARCH_URL, params={"type": "auto", "q": cccd}, timeout=timeout)
+    except requests.RequestException as e:
+        log_fn(f"HTTP request failed for {cccd}: {e}")
+        return Status.TIMEOUT, "", ""
+
+    if resp.status_code in BLOCKED_HTTP_CODES:
+        log_fn(f"Blocked/captcha page (HTTP {resp.status_code}) for {cccd}")
+        return Status.BLOCKED, "", ""
+    if resp.status_code != 200:
+        log_fn(f"Unexpected HTTP {resp.status_code} for {cccd} ({resp.url})")
+        return Status.SYSTEM_ERROR, "", ""
+
+    try:
+        result = parse_result_page(resp.content, url=resp.url)
+    except Exception as e:
+        log_fn(f"Error parsing result for {cccd}: {e}")
+        return Status.SYSTEM_ERROR, "", ""
+
+    if result.page_type not in (DETAIL, LIST, BLOCKED):
+        with open("page_dump.html", "w", encoding="utf-8") as f:
+            f.write(resp.text)
+        log_fn("Dumped page source to page_dump.html due to failure.")
+    return result_status(result)
+
+# ---------- Worker engines ----------
+
+def _replace_tab(driver):
+    """Open a fresh tab and close the current one."""
+    old_handle = driver.current_window_handle
+    driver.switch_to.new_window('tab')
+    new_handle = driver.current_window_handle
+    driver.switch_to.window(old_handle)
+    driver.close()
+    driver.switch_to.window(new_handle)
+
+# Persistent profile dirs held by an engine of this process (several jobs can run in one process)
+_profiles_in_use = set()
+_profiles_lock = threading.Lock()
+
+def _profile_locked_by_live_chrome(profile_dir):
+    """True if the profile's SingletonLock ('<host>-<pid>') names a running process on this host."""
+    try:
+        host, _, pid = os.readlink(os.path.join(profile_dir, "SingletonLock")).rpartition("-")
+        pid = int(pid)
+    except (OSError, ValueError):
+        return False
+    import socket
+
+    if host != socket.gethostname():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _claim_profile(profile_dir):
+    with _profiles_lock:
+        if profile_dir in _profiles_in_use or _profile_locked_by_live_chrome(profile_dir):
+            return False
+        _profiles_in_use.add(profile_dir)
+        return True
+
+def _release_profile(profile_dir):
+    with _profiles_lock:
+        _profiles_in_use.discard(profile_dir)
+
+class LookupEngine:
+    """
+    One isolated lookup backend owned by a single worker: a Chrome driver with its own
+    debugging port and profile dir, or an HTTP session.
+
+    Chrome runs under a DriverSupervisor: a lookup taking longer than `call_timeout` seconds
+    gets the browser killed and replaced, and the browser is recycled every `recycle_after`
+    lookups or above `max_rss_mb` MiB.
+
+    browser_state: shared BrowserState injected into every new driver/session and refreshed
+    from the first completed lookup of each driver, so restarts come back warm.
+    profile_root: keep Chrome profiles in <profile_root>/worker_<id> across runs instead of
+    throwaway temp dirs (run_lookup passes a directory of its own per output file). A profile
+    still used by another live Chrome is never touched: a temp profile is used instead.
+    """
+
+    def __init__(
+        self,
+        kind="selenium",
+        headless=False,
+        worker_id=0,
+        log_fn=log,
+        block_resources=True,
+        call_timeout=120,
+        recycle_after=300,
+        max_rss_mb=1500,
+        browser_state=None,
+        profile_root=None,
+    ):
+        self.kind = kind
+        self.headless = headless
+        self.block_resources = block_resources
+        self.worker_id = worker_id
+        self.log_fn = log_fn
+        self.call_timeout = call_timeout
+        self.recycle_after = recycle_after
+        self.max_rss_mb = max_rss_mb
+        self.browser_state = browser_state
+        self.profile_root = profile_root
+        self._captured_driver = None
+        self.supervisor = None
+        self.session = None
+        self.profile_dir = None
+        self._temp_profile = False
+        self.failures = 0  # consecutive transient failures, drives recover()
+        self._open()
+
+    @property
+    def driver(self):
+        return self.supervisor.driver if self.supervisor is not None else None
+
+    def _profile_for_new_driver(self):
+        if self.profile_root:
+            profile_dir = os.path.join(self.profile_root, f"worker_{self.worker_id}")
+            if profile_dir == self.profile_dir or _claim_profile(profile_dir):
+                if self.profile_dir and self._temp_profile:
+                    shutil.rmtree(self.profile_dir, ignore_errors=True)
+                os.makedirs(profile_dir, exist_ok=True)
+                # A killed Chrome leaves its singleton lock behind, which would block the next launch
+                for name in ("SingletonLock", "SingletonSocket", "SingletonCookie"):
+                    path = os.path.join(profile_dir, name)
+                    if os.path.lexists(path):
+                        os.remove(path)
+                self._temp_profile = False
+                return profile_dir
+            if not self._temp_profile:
+                self.log_fn(f"[worker {self.worker_id}] profile {profile_dir} đang được Chrome khác dùng, dùng profile tạm.")
+        # Fresh profile per browser: a killed Chrome leaves its profile locked
+        if self.profile_dir and self._temp_profile:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+        self._temp_profile = True
+        return tempfile.mkdtemp(prefix=f"mst_chrome_{self.worker_id}_")
+
+    def _new_driver(self):
+        self.profile_dir = self._profile_for_new_driver()
+        driver = init_driver(
+            headless=self.headless,
+            user_data_dir=self.profile_dir,
+            block_resources=self.block_resources,
+        )
+        if self.browser_state:
             try:
-                box = wait_for_presence(driver, search_box_locator)
-                driver.execute_script("arguments[0].value = '';", box)
-                box.send_keys(cccd)
-                safe_click(driver, search_btn_locator)
-            except Exception as js_e:
-                log_fn(f"JS fallback also failed: {js_e}")
-                return "lỗi tương tác search", "", ""
-        
-        # Wait for results
+                self.browser_state.apply_to_driver(driver)
+            except Exception as e:
+                self.log_fn(f"[worker {self.worker_id}] could not restore browser state: {e}")
+        return driver
+
+    def capture_state(self, driver):
+        """Save cookies/localStorage once per driver, after its first completed lookup."""
+        if self.browser_state is None or driver is None or driver is self._captured_driver:
+            return
+        self._captured_driver = driver
         try:
-            wait = WebDriverWait(driver, 10)
-            wait.until(EC.presence_of_element_located((By.TAG_NAME, "h1")))
-            
-            mst = ""
-            name = ""
-            
-            # 1. Try to get Name from H1
-            try:
-                h1_text = driver.find_element(By.TAG_NAME, "h1").text.strip()
-                if " - " in h1_text:
-                    parts = h1_text.split(" - ", 1)
-                    if not name:
-                         name = parts[1].strip()
-            except:
-                pass
-
-            # 2. Extract MST and Name from table
+            self.browser_state.capture(driver)
+        except Exception as e:
+            self.log_fn(f"[worker {self.worker_id}] could not save browser state: {e}")
+
+    def _open(self):
+        if self.kind == "http":
+            self.session = init_session(browser_state=self.browser_state)
+            return
+        self.supervisor = DriverSupervisor(
+            self._new_driver,
+            call_timeout=self.call_timeout,
+            recycle_after=self.recycle_after,
+            max_rss_mb=self.max_rss_mb,
+            log_fn=self.log_fn,
+            name=f"worker {self.worker_id}",
+        )
+
+    def lookup(self, cccd):
+        if self.kind == "http":
+            result = lookup_mst_http(self.session, cccd, log_fn=self.log_fn)
+        else:
             try:
-                mst_element = driver.find_element(By.XPATH, "//td[contains(., 'Mã số thuế')]/following-sibling::td")
-                mst = mst_element.text.strip()
-            except:
+                result = self.supervisor.call(lookup_mst, cccd, log_fn=self.log_fn)
+            except DriverHung:
+                # Already running on a brand new browser, nothing left to recover
+                self.failures += 1
+                return Status.TIMEOUT, "", ""
+        if status_kind(result[0]) == TRANSIENT:
+            self.failures += 1
+            self.recover()
+        else:
+            self.failures = 0
+            if self.kind != "http":
                 try:
-                    mst = driver.find_element(By.CSS_SELECTOR, "[itemprop='taxID']").text.strip()
-                except: pass
+                    self.supervisor.run(self.capture_state)
+                except DriverHung:
+                    pass  # the result stands; the browser was already replaced
+        return result
 
-            if not name:
+    def recover(self):
+        """
+        Cheapest fix first, escalating with consecutive failures:
+        1 -> refresh the page, 2 -> fresh tab, 3+ -> brand new driver (HTTP: new session from 2).
+        """
+        tier = self.failures
+        if self.kind == "http":
+            if tier >= 2:
+                self.log_fn(f"[worker {self.worker_id}] {tier} lỗi liên tiếp, tạo lại HTTP session.")
+                self.restart()
+            return
+        # Under the call deadline too: right after a failure is when Chrome is most likely wedged
+        try:
+            if tier == 1:
+                self.supervisor.run(lambda driver: driver.refresh())
+                return
+            if tier == 2:
+                self.log_fn(f"[worker {self.worker_id}] 2 lỗi liên tiếp, mở tab mới.")
+                self.supervisor.run(_replace_tab)
+                return
+        except DriverHung:
+            return  # the hung browser was already killed and replaced
+        except Exception as e:
+            self.log_fn(f"[worker {self.worker_id}] recovery tier {tier} failed: {e}")
+        self.log_fn(f"[worker {self.worker_id}] {tier} lỗi liên tiếp, khởi động lại trình duyệt.")
+        self.restart()
+
+    def restart(self):
+        self.close()
+        self._open()
+
+    def close(self):
+        try:
+            if self.session is not None:
+                self.session.close()
+            if self.supervisor is not None:
+                self.supervisor.stop()
+        except Exception:
+            pass
+        self.session = None
+        self.supervisor = None
+        if self.profile_dir and self._temp_profile:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+        elif self.profile_dir:
+            _release_profile(self.profile_dir)
+        self.profile_dir = None
+
+class TabMultiplexer:
+    """
+    One supervised Chrome shared by several pipeline workers, one tab each.
+
+    A single driver thread pipelines the lookups: it starts navigation in every idle tab
+    (a non-blocking location.href assignment), then polls the busy tabs round-robin with
+    _EXTRACT_JS, so pages load in parallel while only one WebDriver command is in flight.
+    Workers attach() to it like to a LookupEngine; the browser closes with the last one.
+    """
+
+    def __init__(
+        self,
+        tabs,
+        headless=False,
+        browser_id=0,
+        log_fn=log,
+        block_resources=True,
+        call_timeout=120,
+        recycle_after=300,
+        max_rss_mb=1500,
+        browser_state=None,
+        profile_root=None,
+        page_timeout=20,
+        poll_interval=0.05,
+    ):
+        self.tabs = max(1, int(tabs))
+        self.browser_id = browser_id
+        self.log_fn = log_fn
+        self.page_timeout = page_timeout
+        self.poll_interval = poll_interval
+        self.failures = 0
+        self.users = 0
+        self.closed = False
+        self._lock = threading.Lock()
+        self._requests = queue.SimpleQueue()
+        self._handles = []
+        self._tab_driver = None
+        self._engine = LookupEngine(
+            "selenium",
+            headless=headless,
+            worker_id=browser_id,
+            log_fn=log_fn,
+            block_resources=block_resources,
+            call_timeout=call_timeout,
+            recycle_after=recycle_after,
+            max_rss_mb=max_rss_mb,
+            browser_state=browser_state,
+            profile_root=profile_root,
+        )
+        self._thread = threading.Thread(target=self._run, name=f"tabs-{browser_id}", daemon=True)
+        self._thread.start()
+
+    def attach(self):
+        with self._lock:
+            self.users += 1
+        return self
+
+    def lookup(self, cccd):
+        if self.closed:
+            raise RuntimeError(f"browser {self.browser_id} is closed")
+        future = Future()
+        self._requests.put((cccd, future))
+        return future.result()
+
+    def close(self):
+        with self._lock:
+            self.users -= 1
+            if self.users > 0 or self.closed:
+                return
+            self.closed = True
+        self._requests.put(None)
+        self._thread.join()
+
+    def _run(self):
+        supervisor = self._engine.supervisor
+        backlog = deque()  # (cccd, future) not yet in a tab
+        busy = {}          # window handle -> (cccd, future, started)
+        try:
+            while True:
+                block = not busy and not backlog
                 try:
-                    name_element = driver.find_element(By.XPATH, "//td[contains(., 'Người đại diện')]/following-sibling::td")
-                    name = name_element.text.strip()
-                except:
-                    try:
-                        name = driver.find_element(By.CSS_SELECTOR, "[itemprop='name']").text.strip()
-                    except: pass
-            
-            # Final check
-            if mst:
-                return "thành công", mst, name
+                    while True:
+                        item = self._requests.get(block=block)
+                        if item is None:
+                            return
+                        backlog.append(item)
+                        block = False
+                except queue.Empty:
+                    pass
+
+                # RSS is measured at most every few seconds (DriverSupervisor.rss_check_interval)
+                draining = self.failures >= 3 or bool(supervisor.recycle_reason())
+                if not busy and draining:
+                    # Only restart between lookups, never under an in-flight tab
+                    if self.failures >= 3:
+                        self.log_fn(f"[browser {self.browser_id}] {self.failures} lỗi liên tiếp, khởi động lại trình duyệt.")
+                        supervisor.restart()
+                    else:
+                        supervisor.maybe_recycle()
+                    self.failures = 0
+                    draining = False
+
+                try:
+                    supervisor.run(self._step, backlog, busy, draining)
+                except Exception as e:
+                    if not isinstance(e, DriverHung):
+                        self.log_fn(f"[browser {self.browser_id}] lỗi điều khiển tab: {e}")
+                        supervisor.restart()
+                    for cccd, future, _ in busy.values():
+                        future.set_result((Status.TIMEOUT, "", ""))
+                    busy.clear()
+                    self._tab_driver = None
+                if busy:
+                    time.sleep(self.poll_interval)
+        finally:
+            self.closed = True
+            pending = list(backlog) + [(cccd, future) for cccd, future, _ in busy.values()]
+            while True:
+                try:
+                    item = self._requests.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    pending.append(item)
+            for cccd, future in pending:
+                future.set_exception(RuntimeError(f"browser {self.browser_id} is closed"))
+            self._engine.close()
+
+    def _open_tabs(self, driver):
+        self._handles = [driver.current_window_handle]
+        while len(self._handles) < self.tabs:
+            driver.switch_to.new_window('tab')
+            self._handles.append(driver.current_window_handle)
+        self._tab_driver = driver
+
+    def _step(self, driver, backlog, busy, draining):
+        """One scheduling round: fill idle tabs (unless draining for a restart), then collect every finished one."""
+        if driver is not self._tab_driver:
+            self._open_tabs(driver)
+        for handle in self._handles:
+            if not backlog or draining:
+                break
+            if handle in busy:
+                continue
+            cccd, future = backlog.popleft()
+            self.log_fn(f"Looking up MST for CCCD (tab): {cccd}")
+            driver.switch_to.window(handle)
+            driver.execute_script(
+                "window.__mstPending = true; window.location.href = arguments[0];", _search_url(cccd)
+            )
+            busy[handle] = (cccd, future, time.monotonic())
+
+        for handle, (cccd, future, started) in list(busy.items()):
+            driver.switch_to.window(handle)
+            result = _extract_in_page(driver)
+            if result is None and time.monotonic() - started < self.page_timeout:
+                continue
+            del busy[handle]
+            self._engine.supervisor.calls += 1
+            if result is None:
+                outcome = (Status.TIMEOUT, "", "")
+            elif result.page_type in (DETAIL, LIST, BLOCKED):
+                outcome = result_status(result)
             else:
-                if "Search" in driver.current_url:
-                     return "không tìm thấy (dạng danh sách)", "", ""
-                
-                with open("page_dump.html", "w", encoding="utf-8") as f:
-                    f.write(driver.page_source)
-                log_fn("Dumped page source to page_dump.html due to failure.")
-                return "không tìm thấy thông tin chi tiết", "", ""
+                outcome = (Status.UNKNOWN_PAGE, "", "")
+            if status_kind(outcome[0]) == TRANSIENT:
+                self.failures += 1
+            else:
+                self.failures = 0
+                self._engine.capture_state(driver)
+            future.set_result(outcome)
 
-        except Exception as e:
-            log_fn(f"Timeout or parsed error: {e}")
-            with open("page_dump_error.html", "w", encoding="utf-8") as f:
-                f.write(driver.page_source)
-            return "kết nối thất bại/timeout", "", ""
+def _is_congestion(status):
+    """Transient outcomes (timeouts, blocked pages, site/system errors) all mean: slow down."""
+    return status_kind(status) == TRANSIENT
 
-    except Exception as e:
-        log_fn(f"Error looking up {cccd}: {e}")
-        return "lỗi hệ thống", "", ""
+def _retry_delay(attempt, base_delay, max_delay):
+    """Exponential backoff before retry number `attempt` (1-based)."""
+    return min(max_delay, base_delay * 2 ** (attempt - 1))
 
-def run_lookup(
-    input_path,
-    output_path,
+def _thread_safe_log(log_fn):
+    """
+    Wrap log_fn so worker threads never call it directly (Streamlit widgets only work from the
+    script thread). Messages from other threads are queued and replayed by drain() on the owner.
+    """
+    owner = threading.get_ident()
+    backlog = queue.SimpleQueue()
+
+    def drain():
+        while True:
+            try:
+                msg = backlog.get_nowait()
+            except queue.Empty:
+                return
+            log_fn(msg)
+
+    def log_any(msg):
+        if threading.get_ident() == owner:
+            drain()
+            log_fn(msg)
+        else:
+            backlog.put(msg)
+
+    return log_any, drain
+
+async def _run_pipeline(
+    source,
+    open_engine,
+    workers,
+    bucket,
+    on_result,
+    make_save_job,
+    controller=None,
+    max_attempts=3,
+    retry_base_delay=5.0,
+    max_retry_delay=300.0,
+    tick=None,
+    attempts=None,
+    stop=None,
+    pause=None,
     log_fn=log,
-    batch_size=120,
-    rest_seconds=120,
-    headless=False,
-    progress_fn=None,
 ):
     """
-    Chạy tra cứu toàn bộ file input và lưu ra output. Có thể truyền hàm log_fn để đẩy log lên UI.
+    Feed pending (index, cccd) items to `workers` engines with requests paced by a shared
+    TokenBucket. `source` yields batches (lists) of such items; it is pulled in a reader thread
+    while lookups run, so a large input starts being looked up as soon as its first chunk is
+    ready. Engines are only opened once there is work for them.
+
+    Rows are grouped by CCCD: each distinct value is fetched once, and a row whose CCCD is
+    already queued, waiting for a retry or in flight just joins that lookup (on_result gets
+    every index).
+
+    Blocking lookups run in a thread pool; on_result runs on the event loop and returns True
+    when the output should be materialised; saving (make_save_job() -> zero-arg job) then runs
+    in its own thread, so waiting, fetching, parsing and writing overlap. At most one save is in
+    flight; later requests coalesce into it.
+
+    A transient failure does not block the worker: the CCCD goes back on the queue after an
+    exponential backoff (retry_base_delay * 2**n, capped at max_retry_delay) until max_attempts
+    lookups were made, while the engine itself escalates its own recovery (LookupEngine.recover).
+    `attempts` ({cccd: lookups made}, e.g. restored from a checkpoint) is kept up to date in place.
+
+    stop / pause: threading.Events set from another thread. While `pause` is set no new lookup
+    starts; once `stop` is set the lookups in flight finish and the rest is left pending.
+
+    With an AimdController, each lookup also holds one of its concurrency slots and reports
+    its outcome/latency so rate and concurrency follow what the site tolerates.
     """
-    start_time = time.time()
-    log_fn("Starting lookup process.")
+    import asyncio
 
-    df = None
-    if os.path.exists(output_path):
-        log_fn(f"Found existing result file: {output_path}. Loading to resume...")
-        df = pd.read_excel(output_path, dtype=str)
-    elif os.path.exists(input_path):
-        log_fn(f"Loading input data from {input_path}...")
-        df = pd.read_excel(input_path, dtype=str)
-    else:
-        log_fn(f"Input file {input_path} not found!")
-        return
+    loop = asyncio.get_running_loop()
+    work = asyncio.Queue()
+    groups = {}  # cccd -> row indices waiting for it (queued or in flight)
+    feed = {"done": False, "error": None, "stopped": False}
+    workers = max(1, workers)
+
+    def submit(index, cccd):
+        if cccd in groups:
+            groups[cccd].append(index)
+            return
+        groups[cccd] = [index]
+        work.put_nowait(cccd)
+
+    attempts = {} if attempts is None else attempts  # cccd -> lookups made so far
+    retry_timers = []
+
+    def schedule_retry(cccd):
+        attempt = attempts[cccd]
+        delay = _retry_delay(attempt, retry_base_delay, max_retry_delay)
+        log_fn(f"{cccd}: lỗi tạm thời (lần {attempt}/{max_attempts}), thử lại sau {delay:.0f}s.")
+        retry_timers.append(loop.call_later(delay, work.put_nowait, cccd))
+
+    def finish_if_done():
+        if feed["done"] and (not groups or feed["error"] is not None):
+            for _ in range(workers):
+                work.put_nowait(None)  # wake idle workers so they exit
+
+    read_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reader")
+
+    async def feeder():
+        batches = iter(source)
+        try:
+            while True:
+                batch = await loop.run_in_executor(read_pool, next, batches, None)
+                if batch is None:
+                    break
+                for index, cccd in batch:
+                    submit(index, cccd)
+        except Exception as e:
+            # Stop after the lookups in flight; queued rows stay pending for the next run
+            log_fn(f"Không đọc được dữ liệu đầu vào: {e}")
+            feed["error"] = e
+        finally:
+            feed["done"] = True
+            finish_if_done()
+
+    lookup_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lookup")
+    save_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer")
+    save_state = {"dirty": False, "task": None}
+
+    async def save_loop():
+        while save_state["dirty"]:
+            save_state["dirty"] = False
+            job = make_save_job()
+            try:
+                await loop.run_in_executor(save_pool, job)
+            except Exception as e:
+                log_fn(f"Không ghi được file kết quả: {e}")
+
+    def request_save():
+        save_state["dirty"] = True
+        task = save_state["task"]
+        if task is None or task.done():
+            save_state["task"] = asyncio.ensure_future(save_loop())
+
+    async def worker(worker_id):
+        engine_obj = None
+        try:
+            while True:
+                cccd = await work.get()
+                while pause is not None and pause.is_set() and not feed["stopped"]:
+                    await asyncio.sleep(0.2)
+                if cccd is None or feed["error"] is not None or feed["stopped"]:
+                    return
+                if engine_obj is None:
+                    try:
+                        engine_obj = await loop.run_in_executor(lookup_pool, open_engine, worker_id)
+                    except Exception as e:
+                        log_fn(f"[worker {worker_id}] không khởi động được: {e}")
+                        work.put_nowait(cccd)
+                        return
+                if controller is not None:
+                    await controller.acquire()
+                try:
+                    await bucket.acquire()
+                    started = time.monotonic()
+                    status_new, mst, name = await loop.run_in_executor(lookup_pool, engine_obj.lookup, cccd)
+                except Exception as e:
+                    # Engine is unusable (e.g. restart failed): hand the row to another worker
+                    log_fn(f"[worker {worker_id}] stopped: {e}")
+                    work.put_nowait(cccd)
+                    return
+                finally:
+                    if controller is not None:
+                        await controller.release()
+                if controller is not None:
+                    latency = time.monotonic() - started
+                    if controller.observe(_is_congestion(status_new), latency):
+                        log_fn(
+                            f"Điều chỉnh tốc độ: {controller.rate:.2f} req/s, "
+                            f"{controller.limit}/{controller.max_concurrency} luồng "
+                            f"(kết quả '{status_new}', {latency:.1f}s)"
+                        )
+                attempts[cccd] = attempts.get(cccd, 0) + 1
+                if _is_congestion(status_new) and attempts[cccd] < max_attempts:
+                    schedule_retry(cccd)
+                    continue
+                attempts.pop(cccd, None)
+                if on_result(groups.pop(cccd), cccd, status_new, mst, name):
+                    request_save()
+                finish_if_done()
+        finally:
+            if engine_obj is not None:
+                await loop.run_in_executor(lookup_pool, engine_obj.close)
+
+    async def ticker():
+        while True:
+            await asyncio.sleep(0.2)
+            tick()
+
+    async def watch_stop():
+        while not stop.is_set():
+            await asyncio.sleep(0.2)
+        log_fn("Đã nhận yêu cầu dừng, chờ các lượt đang tra xong.")
+        feed["stopped"] = True
+        for _ in range(workers):
+            work.put_nowait(None)
+
+    tick_task = asyncio.ensure_future(ticker()) if tick else None
+    stop_task = asyncio.ensure_future(watch_stop()) if stop is not None else None
+    feed_task = asyncio.ensure_future(feeder())
+    try:
+        await asyncio.gather(*(worker(i) for i in range(workers)))
+        if not feed_task.done():
+            # Every worker gave up or was stopped: nobody would look up the rest, and a reader
+            # waiting for rows to finish would wait forever
+            if not feed["stopped"]:
+                log_fn("Không còn worker nào, dừng đọc dữ liệu đầu vào.")
+            feed_task.cancel()
+        await asyncio.gather(feed_task, return_exceptions=True)
+    finally:
+        feed_task.cancel()
+        if stop_task is not None:
+            stop_task.cancel()
+        for timer in retry_timers:
+            timer.cancel()
+        if save_state["task"] is not None:
+            await save_state["task"]
+        if tick_task is not None:
+            tick_task.cancel()
+        lookup_pool.shutdown(wait=False)
+        read_pool.shutdown(wait=False)
+        save_pool.shutdown(wait=True)
+
+    if feed["error"] is not None:
+        raise feed["error"]
+    if groups:
+        left = sum(len(indices) for indices in groups.values())
+        reason = "stopped" if feed["stopped"] else "no worker available"
+        log_fn(f"{left} rows were left unprocessed ({reason}).")
+
+# Statuses (lower-cased) that still need a lookup; invalid CCCDs are re-validated every run
+PENDING_STATUSES = ['', 'chưa xử lý', 'chua xu ly', Status.INVALID_CCCD.value.lower()]
+
+_SCIENTIFIC_RE = r"^(\d+)(?:\.(\d+))?[eE]\+?(\d+)$"
+
+def _expand_scientific(mantissa_int, mantissa_frac, exponent):
+    """'1.23456789012E+11' -> '123456789012'; None if Excel rounded digits away."""
+    digits = mantissa_int + (mantissa_frac or "")
+    width = len(mantissa_int) + int(exponent)
+    # Excel's General format shows ~6 significant digits ('1.23457E+11'): those are rounded,
+    # not a real number. A longer mantissa is exact and only trailing zeros were dropped.
+    if len(digits) > width or len(digits) < 9:
+        return None
+    return digits.ljust(width, "0")
+
+def normalize_cccd_series(values):
+    """
+    Vectorised CCCD clean-up for values mangled by Excel/CSV round trips.
+
+    Strips spaces/separators and apostrophes, drops a '.0' suffix, expands scientific notation,
+    and restores lost leading zeros (10-11 digits -> 12-digit CCCD, 8 digits -> 9-digit CMND).
+    Returns (normalised, valid) where valid marks 9-digit CMND / 12-digit CCCD values.
+    """
+    import pandas as pd
+
+    s = values.fillna("").astype(str).str.strip()
+    s = s.str.replace(r"^'", "", regex=True)
+
+    sci = s.str.extract(_SCIENTIFIC_RE)
+    sci_mask = sci[0].notna()
+    if sci_mask.any():
+        expanded = pd.Series(
+            [
+                _expand_scientific(i, f if isinstance(f, str) else "", e) or ""
+                for i, f, e in sci[sci_mask].itertuples(index=False)
+            ],
+            index=s.index[sci_mask],
+            dtype=object,
+        )
+        s = s.mask(sci_mask, expanded)
+
+    s = s.str.replace(r"\.0+$", "", regex=True)
+    s = s.str.replace(r"[\s.\-,_]", "", regex=True)
+
+    lengths = s.str.len()
+    digits = s.str.fullmatch(r"\d+")
+    s = s.mask(digits & lengths.isin([10, 11]), s.str.zfill(12))
+    s = s.mask(digits & (lengths == 8), s.str.zfill(9))
+
+    valid = s.str.fullmatch(r"\d{9}|\d{12}")
+    return s, valid
+
+def _cache_polarity(status):
+    """True for found, False for definitely-not-found, None for results that must not be cached."""
+    kind = status_kind(status)
+    if kind == SUCCESS:
+        return True
+    if kind == TERMINAL and status != Status.INVALID_CCCD:
+        return False
+    return None
 
-    # Normalize and harmonize column names (handle case/accents)
+def _journal_path(output_path):
+    return f"{output_path}.journal.jsonl"
+
+def _checkpoint_path(output_path):
+    return f"{output_path}.checkpoint.json"
+
+def _spool_path(output_path):
+    return f"{output_path}.spool.csv"
+
+def _profile_root_for(profile_root, output_path):
+    """Profiles of one output file: jobs writing other files never share a Chrome profile."""
+    import hashlib
+
+    path = os.path.abspath(output_path)
+    digest = hashlib.sha1(path.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(profile_root, f"{os.path.splitext(os.path.basename(path))[0]}_{digest}")
+
+def _usable_checkpoint(state, spool_path):
+    """Why a saved checkpoint cannot be resumed from, or None if it can."""
+    source = state.get("source")
+    if not source or file_fingerprint(source) != state.get("source_fingerprint"):
+        return "file nguồn đã thay đổi"
+    if state.get("cursor") and (file_fingerprint(spool_path) or [0])[0] < state.get("spool_size", 0):
+        return "thiếu file tạm"
+    return None
+
+def _harmonise_columns(df):
+    """Canonical names for the known columns (case/accents), result columns added when missing."""
     col_map = {}
     for col in df.columns:
         key = col.strip().lower()
@@ -285,77 +1205,504 @@ def run_lookup(
             col_map[col] = 'Tên'
         elif key in ('trạng thái', 'trang thai', 'trang thái'):
             col_map[col] = 'Trạng thái'
+        elif key in ('số lần tra', 'so lan tra'):
+            col_map[col] = CHECKS_COL
+        elif key in ('ngày tra', 'ngay tra'):
+            col_map[col] = CHECKED_AT_COL
     if col_map:
         df.rename(columns=col_map, inplace=True)
 
     # Ensure required columns exist
-    for col in ['CCCD', 'MST', 'Tên', 'Trạng thái']:
+    for col in ['CCCD', 'MST', 'Tên', 'Trạng thái', CHECKS_COL, CHECKED_AT_COL]:
         if col not in df.columns:
             df[col] = ''
-    
+
     # Fill NaN with empty string to avoid float issues if any slipped through
     df.fillna('', inplace=True)
 
-    total_rows = len(df)
-    log_fn(f"Loaded data with {total_rows} rows.")
-    log_fn(f"Columns: {df.columns.tolist()}")
+def _apply_journal(df, records):
+    """
+    Overlay (and consume) journal records {index: record} falling inside df's rows. A record
+    whose CCCD is not the row's (normalised) CCCD belongs to another version of the file and
+    is dropped.
+    """
+    if not records:
+        return 0
+    found = [(index, records.pop(index)) for index in df.index if index in records]
+    if not found:
+        return 0
+    normalised, _ = normalize_cccd_series(df.loc[[index for index, _ in found], 'CCCD'])
+    replayed = 0
+    for index, record in found:
+        if record.get("cccd") != normalised.at[index]:
+            continue
+        df.at[index, 'MST'] = record.get("mst", "")
+        df.at[index, 'Tên'] = record.get("name", "")
+        df.at[index, 'Trạng thái'] = record.get("status", "")
+        if record.get("checks"):
+            df.at[index, CHECKS_COL] = str(record["checks"])
+            df.at[index, CHECKED_AT_COL] = record.get("checked_at", "")
+        replayed += 1
+    return replayed
 
-    driver = init_driver(headless=headless)
-    processed_since_break = 0
+def _select_pending(df, recheck_after_days, max_checks, log_fn=log):
+    """
+    Normalise df's CCCD column in place (invalid values get their status) and return the
+    (index, cccd) rows that need a lookup, selected with vectorised masks.
+    """
+    import pandas as pd
 
-    try:
-        for index, row in df.iterrows():
-            status = str(row.get('Trạng thái', '')).strip().lower()
-            cccd = str(row.get('CCCD', '')).strip()
-            log_fn(f"Row {index}: CCCD='{cccd}', Status='{status}'")
+    # Normalise the CCCD column up front; hopeless values never reach the fetch queue
+    raw_cccd = df['CCCD'].astype(str).str.strip()
+    normalised, valid = normalize_cccd_series(raw_cccd)
+    present = raw_cccd != ''
+    df.loc[valid, 'CCCD'] = normalised[valid]
+    invalid = present & ~valid
+    if invalid.any():
+        df.loc[invalid, 'Trạng thái'] = Status.INVALID_CCCD.label
+        df.loc[invalid, ['MST', 'Tên']] = ''
+        log_fn(f"{int(invalid.sum())} CCCD không hợp lệ (không phải 9 hoặc 12 chữ số), bỏ qua.")
 
-            if not cccd:
-                log_fn("CCCD trống, bỏ qua hàng này.")
-                continue
+    # Finished rows never enter the fetch queue
+    status = df['Trạng thái'].astype(str).str.strip().str.lower()
+    kind = status_kinds(status)
+    checks = pd.to_numeric(df[CHECKS_COL], errors='coerce').fillna(0).astype(int)
+    checked_at = pd.to_datetime(df[CHECKED_AT_COL], errors='coerce')
+    recheck_due = (checks < max_checks) & (
+        checked_at.isna() | (checked_at <= pd.Timestamp.now() - pd.Timedelta(days=recheck_after_days))
+    )
+    terminal = kind == TERMINAL
+    pending_mask = valid & (
+        status.isin(PENDING_STATUSES)
+        | (kind == TRANSIENT)
+        | (terminal & recheck_due)
+    )
+    settled = int((valid & terminal & ~recheck_due & ~status.isin(PENDING_STATUSES)).sum())
+    if settled:
+        log_fn(f"{settled} dòng không tìm thấy chưa đến hạn tra lại (sau {recheck_after_days} ngày, tối đa {max_checks} lần), bỏ qua.")
+    empty_count = int((~present).sum())
+    if empty_count:
+        log_fn(f"{empty_count} dòng CCCD trống, bỏ qua.")
+    pending_index = df.index[pending_mask].to_numpy()
+    pending = list(zip(pending_index.tolist(), df['CCCD'].to_numpy()[pending_mask.to_numpy()].tolist()))
+    return pending
 
-            pending_statuses = {'', 'chưa xử lý', 'chua xu ly'}
-            if status in pending_statuses or 'lỗi' in status or 'không tìm thấy' in status:
-                attempts = 0
-                while True:
-                    status_new, mst, name = lookup_mst(driver, cccd, log_fn=log_fn)
-
-                    # Retry once with a fresh driver if we hit site/interaction errors
-                    if (status_new.startswith('lỗi') or 'kết nối' in status_new) and attempts == 0:
-                        attempts += 1
-                        log_fn("Encountered lỗi, restarting trình duyệt và thử lại...")
-                        try:
-                            driver.quit()
-                        except Exception:
-                            pass
-                        driver = init_driver(headless=headless)
-                        continue
-                    break
-                
-                df.at[index, 'MST'] = mst
-                df.at[index, 'Tên'] = name
-                df.at[index, 'Trạng thái'] = status_new
-                
-                log_fn(f"Processed {cccd}: {status_new}, MST: {mst}, Name: {name}")
-                processed_since_break += 1
-                
-                # Save incrementally to result file
-                df.to_excel(output_path, index=False)
-                time.sleep(2) # Polite delay
-
-                # Optional rest to avoid throttling
-                if batch_size and processed_since_break % batch_size == 0:
-                    log_fn(f"Đã xử lý {processed_since_break} bản ghi, nghỉ {rest_seconds} giây...")
-                    time.sleep(rest_seconds)
-
-            # Cập nhật tiến trình
-            if progress_fn:
-                progress_fn(index + 1, total_rows)
-                
+def run_lookup(
+    input_path,
+    output_path,
+    log_fn=log,
+    headless=False,
+    progress_fn=None,
+    engine="selenium",
+    workers=1,
+    rate=0.5,
+    burst=1,
+    adaptive=False,
+    max_rate=5.0,
+    block_resources=True,
+    save_every=200,
+    sync_every=50,
+    cache_path=CACHE_FILE,
+    positive_ttl_days=30,
+    negative_ttl_days=7,
+    cache_max_entries=500_000,
+    recheck_after_days=30,
+    max_checks=3,
+    max_attempts=3,
+    retry_base_delay=5.0,
+    call_timeout=120,
+    recycle_after=300,
+    max_rss_mb=1500,
+    tabs=1,
+    state_path=BROWSER_STATE_FILE,
+    profile_root=CHROME_PROFILE_DIR,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    max_windows=4,
+    output_format=None,
+    checkpoint_every=10.0,
+    stop_event=None,
+    pause_event=None,
+):
+    """
+    Chạy tra cứu toàn bộ file input và lưu ra output. Có thể truyền hàm log_fn để đẩy log lên UI.
+    input_path: .xlsx, .xls hoặc .csv (nhận dạng theo nội dung file), được đọc dần từng `chunk_size`
+        dòng; các dòng đầu được tra ngay trong khi phần còn lại của file vẫn đang được đọc.
+    max_windows: số phần `chunk_size` dòng giữ trong bộ nhớ cùng lúc (dạng nén: CCCD dạng bytes,
+        trạng thái dạng mã số). Phần đã tra xong được ghi tạm ra đĩa; việc đọc tạm dừng khi đủ
+        `max_windows` phần còn đang tra, nên bộ nhớ không tăng theo kích thước file.
+    checkpoint_every: mỗi lần chạy có một mã (run id) và file `<output>.checkpoint.json` được ghi lại
+        (nguyên tử) mỗi `checkpoint_every` giây: số dòng đầu đã xong và nằm trong file tạm, các CCCD
+        đang chờ thử lại, tốc độ hiện tại. Chạy lại sau khi bị ngắt sẽ tiếp tục từ đó, không đọc
+        lại phần đầu của file.
+    stop_event, pause_event: threading.Event để điều khiển từ luồng khác (xem jobs.py): pause_event
+        tạm ngừng lấy CCCD mới; stop_event dừng sau các lượt đang tra, kết quả và checkpoint được giữ.
+    output_format: "xlsx" (ghi streaming, không dựng cả bảng trong bộ nhớ), "csv" hoặc "parquet"
+        (cần pyarrow); mặc định theo đuôi của output_path.
+    engine: "selenium" (mặc định, dùng Chrome) hoặc "http" (gọi thẳng trang tìm kiếm, không cần Chrome).
+    workers: số trình duyệt/session chạy song song; kết quả được gộp và ghi bởi một luồng duy nhất.
+    rate, burst: giới hạn tốc độ chung cho mọi worker (số request/giây, số request được gửi dồn).
+    adaptive: tự điều chỉnh tốc độ/số luồng (AIMD) theo phản hồi của trang, bắt đầu từ `rate`,
+        tối đa `max_rate`. Chỉ khi adaptive, progress_fn nhận thêm tham số rate= (tốc độ hiện tại, req/s).
+    block_resources: (selenium) không tải ảnh/font/quảng cáo/tracker, trang trả về ngay khi có DOM.
+    save_every: kết quả được ghi nối vào journal `<output>.journal.jsonl` (fsync mỗi `sync_every`
+        dòng); file Excel chỉ được ghi lại sau mỗi `save_every` dòng và khi kết thúc.
+    cache_path: cache SQLite CCCD -> kết quả dùng chung giữa các lần chạy/các file (None để tắt).
+        Kết quả tìm thấy giữ `positive_ttl_days` ngày, không tìm thấy giữ `negative_ttl_days` ngày.
+    recheck_after_days, max_checks: dòng "không tìm thấy" (kết quả cuối) chỉ được tra lại sau
+        `recheck_after_days` ngày và tổng cộng tối đa `max_checks` lần; dòng lỗi/timeout luôn được tra lại.
+    max_attempts, retry_base_delay: lỗi tạm thời được đưa vào hàng đợi thử lại sau
+        retry_base_delay * 2^n giây (tối đa `max_attempts` lần tra trong một lần chạy), không chặn worker.
+    call_timeout, recycle_after, max_rss_mb: (selenium) một lượt tra treo quá `call_timeout` giây thì
+        Chrome bị kill và mở lại; trình duyệt được làm mới sau `recycle_after` lượt hoặc khi dùng
+        quá `max_rss_mb` MiB RAM (cần psutil).
+    tabs: (selenium) số tab mỗi trình duyệt; mỗi Chrome tra song song `tabs` CCCD, tổng cộng
+        workers * tabs lượt tra đồng thời mà chỉ tốn RAM của `workers` trình duyệt.
+    state_path: file JSON lưu cookie/localStorage (đồng ý cookie, popup đã tắt, ...) được nạp vào mọi
+        trình duyệt mới và HTTP session (None để tắt). profile_root: giữ profile Chrome trên đĩa giữa các lần chạy
+        (mỗi file kết quả một thư mục con riêng).
+    """
+    import asyncio
+    from bisect import bisect_right
+
+    from row_window import Categories, RowWindow
+    from throttle import AimdController, TokenBucket
+
+    if engine not in ("selenium", "http"):
+        raise ValueError(f"Unknown engine: {engine!r} (expected 'selenium' or 'http')")
+    # Before any lookup: a run must not fail only when its results are written
+    output_format = output_format_for(output_path, output_format)
+
+    start_time = time.time()
+    log_fn("Starting lookup process.")
+
+    checkpoint = RunCheckpoint(_checkpoint_path(output_path))
+    spool_path = _spool_path(output_path)
+    resumed = checkpoint.load()
+    if resumed is not None:
+        reason = _usable_checkpoint(resumed, spool_path)
+        if reason:
+            # The journal is kept: _apply_journal only replays records whose CCCD still matches
+            log_fn(f"Bỏ qua checkpoint {checkpoint.path} ({reason}).")
+            resumed = None
+
+    if resumed is not None:
+        run_id = resumed["run_id"]
+        source_path = resumed["source"]
+        cursor = int(resumed.get("cursor", 0))
+        log_fn(f"Resuming run {run_id} from row {cursor} of {source_path}.")
+    else:
+        run_id = new_run_id()
+        cursor = 0
+        if os.path.exists(output_path):
+            log_fn(f"Found existing result file: {output_path}. Loading to resume...")
+            source_path = output_path
+        elif os.path.exists(input_path):
+            log_fn(f"Loading input data from {input_path} ({detect_format(input_path)})...")
+            source_path = input_path
+        else:
+            log_fn(f"Input file {input_path} not found!")
+            return
+        log_fn(f"Run {run_id}.")
+
+    # Results from a previous run that stopped before the workbook was rewritten; rows before
+    # the checkpoint cursor are already final in the spool
+    journal_path = _journal_path(output_path)
+    journal_records = {}
+    for record in ResultJournal.replay(journal_path):
+        index = record.get("index")
+        if isinstance(index, int) and index >= cursor:
+            journal_records[index] = record
+    if journal_records:
+        log_fn(f"Recovering {len(journal_records)} result(s) from journal {journal_path}.")
+
+    cache = None
+    if cache_path:
+        cache = ResultCache(
+            cache_path,
+            positive_ttl=positive_ttl_days * DAY,
+            negative_ttl=negative_ttl_days * DAY,
+            max_entries=cache_max_entries,
+        )
+
+    workers = max(1, int(workers))
+    log_fn(f"Up to {workers} worker(s) ({engine}), rate {rate}/s, burst {burst}.")
+
+    log_any, drain_log = _thread_safe_log(log_fn)
+    # Windows still in memory, in file order (starts[i] is windows[i].start). Finished windows
+    # are moved to the spool from the front; the reader waits while max_windows are open.
+    windows = []
+    starts = []
+    windows_changed = threading.Condition()
+    statuses = Categories()
+    timestamps = Categories()
+    spool = CsvSpool(spool_path)
+    if resumed is not None:
+        spool.reopen(cursor, resumed.get("spool_size", 0))
+    max_windows = max(1, int(max_windows))
+    reading = {"done": False, "closing": False}
+    # Progress is measured against rows that needed work this run, not the whole file
+    progress = {"done": 0, "pending": 0, "reported": None}
+    unsaved = 0
+
+    def spill_finished():
+        """Append the finished windows at the front to the spool (caller holds windows_changed)."""
+        while windows and windows[0].pending == 0:
+            spool.append(windows[0].to_frame())
+            del windows[0], starts[0]
+
+    def window_of(index):
+        return windows[bisect_right(starts, index) - 1]
+
+    def batches():
+        """Read the table chunk by chunk, yielding the rows each chunk still needs looked up."""
+        total_rows = cursor
+        for chunk in iter_chunks(source_path, chunk_size, skip_rows=cursor):
+            if total_rows == cursor:
+                log_any(f"Columns: {chunk.columns.tolist()}")
+            _harmonise_columns(chunk)
+            unmatched = len(journal_records)
+            unmatched -= _apply_journal(chunk, journal_records) + len(journal_records)
+            if unmatched:
+                log_any(f"Journal: bỏ {unmatched} kết quả có CCCD không khớp với dòng hiện tại.")
+            pending = _select_pending(chunk, recheck_after_days, max_checks, log_any)
+            total_rows += len(chunk)
+            progress["pending"] += len(pending)
+
+            if cache is not None and pending:
+                hits = cache.get_many([cccd for _, cccd in pending])
+                if hits:
+                    import pandas as pd
+
+                    misses = []
+                    checks = pd.to_numeric(chunk[CHECKS_COL], errors='coerce').fillna(0).astype(int)
+                    for index, cccd in pending:
+                        cached = hits.get(cccd)
+                        # Entries written before UNKNOWN_PAGE existed may hold a non-cacheable status
+                        if cached is None or _cache_polarity(cached[0]) is None:
+                            misses.append((index, cccd))
+                            continue
+                        # A cached answer is a check made at fetched_at: stamped and journaled like
+                        # one from the site, so recheck_after_days/max_checks apply to it too
+                        status_cached, mst, name, fetched_at = cached
+                        row_checks = int(checks.at[index]) + 1
+                        checked_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(fetched_at))
+                        chunk.at[index, 'MST'] = mst
+                        chunk.at[index, 'Tên'] = name
+                        chunk.at[index, 'Trạng thái'] = status_cached
+                        chunk.at[index, CHECKS_COL] = str(row_checks)
+                        chunk.at[index, CHECKED_AT_COL] = checked_at
+                        with windows_changed:
+                            journal.append(
+                                index, cccd, status_cached, mst, name, checks=row_checks, checked_at=checked_at
+                            )
+                    log_any(f"Cache: {len(pending) - len(misses)} row(s) answered from {cache_path}.")
+                    progress["done"] += len(pending) - len(misses)
+                    pending = misses
+
+            window = RowWindow(chunk, statuses, timestamps, pending=len(pending))
+            del chunk
+            with windows_changed:
+                if reading["closing"]:
+                    return
+                windows.append(window)
+                starts.append(window.start)
+                spill_finished()
+            if pending:
+                log_any(f"Rows {window.start}-{window.start + window.size - 1}: {len(pending)} pending.")
+                yield pending
+            with windows_changed:
+                # Backpressure: the next chunk is only read once an open window has finished
+                while len(windows) >= max_windows:
+                    windows_changed.wait(1.0)
+                    if reading["closing"]:
+                        return
+                    spill_finished()
+        reading["done"] = True
+        log_any(f"Loaded data with {total_rows} rows.")
+
+    def output_chunks(spooled, frames):
+        yield from spool.iter_chunks(chunk_size, rows=spooled)
+        yield from frames
+
+    def report_progress():
+        state = (progress["done"], progress["pending"])
+        if progress_fn and state != progress["reported"]:
+            progress["reported"] = state
+            if controller is not None:
+                progress_fn(progress["done"], progress["pending"], rate=bucket.rate)
+            else:
+                # Same call as before adaptive mode existed: two-argument callbacks keep working
+                progress_fn(progress["done"], progress["pending"])
+
+    run_state = {"run_id": run_id, "source": source_path, "source_fingerprint": file_fingerprint(source_path)}
+    attempts = dict(resumed.get("attempts") or {}) if resumed is not None else {}
+    last_checkpoint = {"at": 0.0}
+
+    def save_checkpoint():
+        # Held while writing too: the writer thread saves after each rewrite of the output, and
+        # an older snapshot from the event loop must not land after it
+        with windows_changed:
+            last_checkpoint["at"] = time.monotonic()
+            state = dict(run_state, cursor=spool.rows, spool_size=spool.size)
+            state.update(
+                attempts=dict(attempts),
+                rate=bucket.rate,
+                limit=controller.limit if controller is not None else lanes,
+            )
+            try:
+                checkpoint.save(state)
+            except OSError as e:
+                log_any(f"Không ghi được checkpoint {checkpoint.path}: {e}")
+
+    def tick():
+        drain_log()
+        report_progress()
+        if checkpoint_every and time.monotonic() - last_checkpoint["at"] >= checkpoint_every:
+            save_checkpoint()
+
+    journal = ResultJournal(journal_path, sync_every=sync_every)
+
+    engine_options = dict(
+        headless=headless,
+        log_fn=log_any,
+        block_resources=block_resources,
+        call_timeout=call_timeout,
+        recycle_after=recycle_after,
+        max_rss_mb=max_rss_mb,
+        browser_state=BrowserState(state_path) if state_path else None,
+        profile_root=_profile_root_for(profile_root, output_path) if profile_root else None,
+    )
+    tabs = max(1, int(tabs)) if engine == "selenium" else 1
+    lanes = workers * tabs
+    browsers = {}
+    browsers_lock = threading.Lock()
+
+    def open_engine(worker_id):
+        if tabs > 1:
+            # Workers come in groups of `tabs` sharing one Chrome
+            with browsers_lock:
+                browser_id = worker_id // tabs
+                mux = browsers.get(browser_id)
+                if mux is None or mux.closed:
+                    mux = browsers[browser_id] = TabMultiplexer(tabs, browser_id=browser_id, **engine_options)
+                return mux.attach()
+        return LookupEngine(
+            engine,
+            worker_id=worker_id,
+            **engine_options,
+        )
+
+    def on_result(indices, cccd, status_new, mst, name):
+        nonlocal unsaved
+        polarity = _cache_polarity(status_new)
+        if cache is not None and polarity is not None:
+            try:
+                cache.put(cccd, status_new, mst, name, positive=polarity)
+            except Exception as e:
+                # The cache is an optimisation: the row itself is still journaled and saved
+                log_any(f"Không ghi được cache cho {cccd}: {e}")
+        checked_at_now = time.strftime("%Y-%m-%d %H:%M:%S")
+        # Only answers from the site count towards max_checks, not timeouts/errors
+        counted = 0 if status_kind(status_new) == TRANSIENT else 1
+        with windows_changed:
+            for index in indices:
+                window = window_of(index)
+                row_checks = window.checks_of(index) + counted
+                journal.append(
+                    index, cccd, status_new, mst, name, checks=row_checks, checked_at=checked_at_now
+                )
+                window.set_result(index, str(status_new), mst, name, row_checks, checked_at_now)
+                window.pending -= 1
+                if window.pending == 0:
+                    windows_changed.notify()
+        copies = f" ({len(indices)} dòng)" if len(indices) > 1 else ""
+        log_any(f"Processed {cccd}{copies}: {status_new}, MST: {mst}, Name: {name}")
+
+        # Cập nhật tiến trình
+        progress["done"] += len(indices)
+        report_progress()
+
+        unsaved += len(indices)
+        # A partial table must never replace the output: intermediate saves wait for the full read
+        if save_every and unsaved >= save_every and reading["done"]:
+            unsaved = 0
+            return True
+        return False
+
+    def make_save_job():
+        # Snapshot on the event loop so the writer thread never sees a half-applied row
+        with windows_changed:
+            spooled = spool.rows
+            snapshot = [window.to_frame() for window in windows]
+
+        def save():
+            write_table(output_chunks(spooled, snapshot), output_path, output_format)
+            if source_path == output_path:
+                # The rows after the cursor are re-read from the new file on resume; record its
+                # fingerprint right away, or a crash before the next tick rejects the checkpoint
+                run_state["source_fingerprint"] = file_fingerprint(output_path)
+                save_checkpoint()
+
+        return save
+
+    if adaptive and resumed is not None and resumed.get("rate"):
+        # Pick up at the pace the site tolerated before the restart
+        bucket = TokenBucket(resumed["rate"], burst)
+    else:
+        bucket = TokenBucket(rate, burst)
+    controller = AimdController(bucket, max_concurrency=lanes, max_rate=max_rate) if adaptive else None
+    if controller is not None and resumed is not None and resumed.get("limit"):
+        controller.limit = max(1, min(lanes, int(resumed["limit"])))
+    save_checkpoint()
+
+    try:
+        asyncio.run(_run_pipeline(
+            batches(),
+            open_engine,
+            lanes,
+            bucket,
+            on_result,
+            make_save_job,
+            controller=controller,
+            max_attempts=max_attempts,
+            retry_base_delay=retry_base_delay,
+            tick=tick,
+            attempts=attempts,
+            stop=stop_event,
+            pause=pause_event,
+            log_fn=log_any,
+        ))
     finally:
-        try:
-            driver.quit()
-        except Exception:
-            pass
+        with windows_changed:
+            reading["closing"] = True
+            windows_changed.notify_all()
+        tick()
+        journal.close()
+        if cache is not None:
+            cache.close()
+        finished = False
+        if not reading["done"]:
+            log_fn(f"Chưa đọc hết dữ liệu đầu vào; giữ nguyên file kết quả, kết quả đã tra nằm trong journal {journal_path}.")
+        else:
+            try:
+                # Spooled rows, then the windows still in memory, decoded one chunk at a time
+                write_table(
+                    output_chunks(spool.rows, (window.to_frame() for window in windows)),
+                    output_path,
+                    output_format,
+                )
+                # Output now holds everything the journal had
+                os.remove(journal_path)
+                finished = True
+            except Exception as e:
+                log_fn(f"Không ghi được file kết quả, giữ lại journal {journal_path}: {e}")
+        with windows_changed:
+            if finished:
+                checkpoint.remove()
+            else:
+                save_checkpoint()
+                log_fn(f"Đã lưu checkpoint {checkpoint.path}; chạy lại để tiếp tục run {run_id} từ dòng {spool.rows}.")
+            spool.close(keep=not finished)
         elapsed = time.time() - start_time
         log_fn(f"Done. Thời gian xử lý: {elapsed:.2f} giây.")
 
@@ -0,0 +1,374 @@
+"""
+Tabular input/output for run_lookup.
+
+Whatever the format, a file is read as a stream of DataFrame chunks of at most `chunk_size`
+rows (all values str, '' for blanks, one global RangeIndex across chunks), so lookups can
+start on the first chunk while the rest of a large file is still being read:
+
+    xlsx - openpyxl read-only mode: rows are parsed from the sheet XML as they are consumed
+    csv  - pandas chunked reader; encoding (UTF-8 with/without BOM, else Windows-1258) and
+           delimiter are sniffed from the first block
+    xls  - legacy binary workbook, read in one go through pandas (needs xlrd)
+    parquet - record batches through pyarrow (optional dependency)
+
+The format is detected from the file content, not its name, so an upload saved under the
+wrong extension is still read correctly.
+
+Outputs are written from the same kind of chunk stream without ever building the whole
+table: xlsx through openpyxl's write-only mode, csv (UTF-8 with BOM, opens cleanly in Excel)
+or parquet (one row group per chunk). Writes go to a temp file that replaces the target only
+once complete. CsvSpool holds finished chunks on disk until the final write.
+"""
+import csv
+import os
+
+XLSX = "xlsx"
+XLS = "xls"
+CSV = "csv"
+PARQUET = "parquet"
+OUTPUT_FORMATS = (XLSX, CSV, PARQUET)
+
+DEFAULT_CHUNK_SIZE = 50_000
+
+_SNIFF_BYTES = 64 * 1024
+
+
+def detect_format(path):
+    """xlsx / xls / parquet from the file's magic bytes; anything else is treated as delimited text."""
+    with open(path, "rb") as f:
+        head = f.read(8)
+    if head.startswith(b"PK\x03\x04"):
+        return XLSX
+    if head.startswith(b"\xd0\xcf\x11\xe0"):
+        return XLS
+    if head.startswith(b"PAR1"):
+        return PARQUET
+    return CSV
+
+
+def iter_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE, skip_rows=0):
+    """
+    Yield the rows of `path` as str DataFrames of at most chunk_size rows. skip_rows: start
+    after that many data rows (the index still counts from the top of the file); skipped rows
+    are not turned into values where the format allows it.
+    """
+    fmt = detect_format(path)
+    if fmt == XLSX:
+        chunks = _iter_xlsx(path, chunk_size, skip_rows)
+    elif fmt == XLS:
+        chunks = _iter_xls(path, chunk_size, skip_rows)
+    elif fmt == PARQUET:
+        chunks = _iter_parquet(path, chunk_size, skip_rows)
+    else:
+        chunks = _iter_csv(path, chunk_size, skip_rows)
+    offset = skip_rows
+    try:
+        for chunk in chunks:
+            chunk.index = range(offset, offset + len(chunk))
+            offset += len(chunk)
+            yield chunk
+    finally:
+        chunks.close()  # closes the workbook/file even when the caller stops early
+
+
+def _unique_columns(header):
+    """Same naming as pandas: blank -> 'Unnamed: i', repeats -> 'name.1', 'name.2', ..."""
+    columns = []
+    seen = {}
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if name in ("", None) else str(name)
+        base = name
+        while name in seen:
+            seen[base] += 1
+            name = f"{base}.{seen[base]}"
+        seen.setdefault(name, 0)
+        columns.append(name)
+    return columns
+
+
+def _cell_text(value):
+    # Mirrors pandas' openpyxl reader + dtype=str: integral floats lose their '.0'
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _frame(rows, columns):
+    import pandas as pd
+
+    return pd.DataFrame(rows, columns=columns, dtype=object)
+
+
+def _iter_xlsx(path, chunk_size, skip_rows=0):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        # Some writers store a wrong <dimension>; don't let it truncate the sheet
+        ws.reset_dimensions()
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        if skip_rows:
+            # Rows above min_row are only scanned, not converted
+            rows.close()
+            rows = ws.iter_rows(min_row=skip_rows + 2, values_only=True)
+        header = list(header)
+        while header and header[-1] is None:
+            header.pop()
+        columns = _unique_columns(header)
+        width = len(columns)
+
+        chunk = []
+        blanks = []  # blank rows are kept only if data follows them (pandas trims trailing ones)
+        for row in rows:
+            values = [_cell_text(v) for v in row[:width]]
+            if not any(values):
+                blanks.append([""] * width)
+                continue
+            if blanks:
+                chunk.extend(blanks)
+                blanks = []
+            values.extend([""] * (width - len(values)))
+            chunk.append(values)
+            if len(chunk) >= chunk_size:
+                yield _frame(chunk[:chunk_size], columns)
+                chunk = chunk[chunk_size:]
+        while chunk:
+            yield _frame(chunk[:chunk_size], columns)
+            chunk = chunk[chunk_size:]
+    finally:
+        wb.close()
+
+
+def _iter_xls(path, chunk_size, skip_rows=0):
+    import pandas as pd
+
+    df = pd.read_excel(path, dtype=str).fillna("")
+    for start in range(skip_rows, len(df), chunk_size):
+        yield df.iloc[start:start + chunk_size].reset_index(drop=True)
+
+
+def _sniff_csv(path):
+    with open(path, "rb") as f:
+        sample = f.read(_SNIFF_BYTES)
+    try:
+        # A multi-byte character may be cut at the end of the sample
+        sample.decode("utf-8")
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError as e:
+        encoding = "utf-8-sig" if e.start >= len(sample) - 3 else "cp1258"
+    text = sample.decode(encoding, errors="ignore")
+    try:
+        head = "\n".join(text.splitlines()[:20])
+        delimiter = csv.Sniffer().sniff(head, delimiters=",;\t|").delimiter
+    except csv.Error:
+        delimiter = ","
+    return encoding, delimiter
+
+
+def _iter_csv(path, chunk_size, skip_rows=0):
+    import pandas as pd
+
+    encoding, delimiter = _sniff_csv(path)
+    reader = pd.read_csv(
+        path,
+        sep=delimiter,
+        dtype=str,
+        keep_default_na=False,
+        encoding=encoding,
+        chunksize=chunk_size,
+    )
+    with reader:
+        for chunk in reader:
+            # Quoted fields may span lines, so rows are skipped after parsing, not as lines
+            if skip_rows >= len(chunk):
+                skip_rows -= len(chunk)
+                continue
+            yield chunk.iloc[skip_rows:].reset_index(drop=True).fillna("")
+            skip_rows = 0
+
+
+def _iter_parquet(path, chunk_size, skip_rows=0):
+    pq = _pyarrow_parquet()
+    with pq.ParquetFile(path) as f:
+        # Whole row groups before skip_rows are not read at all
+        groups = []
+        for i in range(f.metadata.num_row_groups):
+            group_rows = f.metadata.row_group(i).num_rows
+            if skip_rows >= group_rows and not groups:
+                skip_rows -= group_rows
+                continue
+            groups.append(i)
+        if not groups:
+            return
+        for batch in f.iter_batches(batch_size=chunk_size, row_groups=groups):
+            if skip_rows >= batch.num_rows:
+                skip_rows -= batch.num_rows
+                continue
+            batch = batch.slice(skip_rows)
+            skip_rows = 0
+            yield batch.to_pandas().astype(object).fillna("").astype(str)
+
+
+def parquet_available():
+    """Whether pyarrow is installed, without importing it."""
+    from importlib.util import find_spec
+
+    return find_spec("pyarrow") is not None
+
+
+def _pyarrow_parquet():
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet needs pyarrow: pip install pyarrow") from None
+    return pq
+
+
+class CsvSpool:
+    """
+    Append-only CSV scratch file of finished chunks, read back as str chunks. `rows` counts
+    what was appended (`size` its bytes), so a reader can stop at a consistent point while
+    appends go on. Every append is fsync'd, so rows/size can be checkpointed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.size = 0
+        self._file = None
+
+    def reopen(self, rows, size):
+        """Continue a spool left by an interrupted run, dropping anything written past rows/size."""
+        if not rows:
+            return
+        os.truncate(self.path, size)
+        self._file = open(self.path, "a", encoding="utf-8", newline="")
+        self.rows = rows
+        self.size = size
+
+    def append(self, frame):
+        if self._file is None:
+            self._file = open(self.path, "w", encoding="utf-8", newline="")
+        frame.to_csv(self._file, header=not self.size, index=False)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.rows += len(frame)
+        self.size = self._file.tell()
+
+    def iter_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE, rows=None):
+        """The first `rows` (default: all) appended rows, as str DataFrames."""
+        import pandas as pd
+
+        rows = self.rows if rows is None else rows
+        if not rows:
+            return
+        reader = pd.read_csv(
+            self.path,
+            dtype=str,
+            keep_default_na=False,
+            encoding="utf-8",
+            nrows=rows,
+            chunksize=chunk_size,
+        )
+        offset = 0
+        with reader:
+            for chunk in reader:
+                chunk.index = range(offset, offset + len(chunk))
+                offset += len(chunk)
+                yield chunk
+
+    def close(self, keep=False):
+        """Close the scratch file; it is deleted unless `keep` (a checkpoint refers to it)."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not keep and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def output_format_for(path, output_format=None):
+    """
+    Explicit output_format, else the output file's extension (xlsx when unknown). Raises
+    right away when the format cannot be written (parquet without pyarrow).
+    """
+    fmt = (output_format or os.path.splitext(path)[1].lstrip(".") or XLSX).lower()
+    if fmt == "xls":
+        fmt = XLSX
+    if fmt not in OUTPUT_FORMATS:
+        if output_format:
+            raise ValueError(f"Unknown output_format: {output_format!r} (expected one of {', '.join(OUTPUT_FORMATS)})")
+        fmt = XLSX
+    if fmt == PARQUET and not parquet_available():
+        _pyarrow_parquet()  # raises the install hint
+    return fmt
+
+
+def write_table(chunks, path, output_format=None):
+    """
+    Stream DataFrame chunks (same columns) into path as xlsx/csv/parquet. The file appears
+    atomically: a crash mid-write leaves the previous version untouched.
+    """
+    fmt = output_format_for(path, output_format)
+    folder = os.path.dirname(os.path.abspath(path))
+    base, ext = os.path.splitext(os.path.basename(path))
+    tmp_path = os.path.join(folder, f"{base}.tmp{ext or '.' + fmt}")
+    try:
+        if fmt == XLSX:
+            _write_xlsx(chunks, tmp_path)
+        elif fmt == CSV:
+            _write_csv(chunks, tmp_path)
+        else:
+            _write_parquet(chunks, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _write_xlsx(chunks, path):
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    header_written = False
+    for chunk in chunks:
+        if not header_written:
+            ws.append([str(col) for col in chunk.columns])
+            header_written = True
+        for row in chunk.itertuples(index=False, name=None):
+            # Everything is text so CCCD/MST keep their leading zeros
+            ws.append(["" if v is None else str(v) for v in row])
+    wb.save(path)
+
+
+def _write_csv(chunks, path):
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        first = True
+        for chunk in chunks:
+            chunk.to_csv(f, header=first, index=False)
+            first = False
+
+
+def _write_parquet(chunks, path):
+    import pyarrow as pa
+
+    pq = _pyarrow_parquet()
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk.astype(str), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+        if writer is None:
+            pq.write_table(pa.table({}), path)
+    finally:
+        if writer is not None:
+            writer.close()
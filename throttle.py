@@ -0,0 +1,140 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Async token bucket shared by every in-flight lookup.
+
+    rate: tokens added per second (= allowed requests per second)
+    burst: bucket capacity, i.e. how many requests may go out back-to-back after an idle period
+    """
+
+    def __init__(self, rate, burst=1, clock=time.monotonic):
+        if rate <= 0:
+            raise ValueError("rate must be > 0")
+        self._rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._lock = None
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @rate.setter
+    def rate(self, value):
+        # Settle tokens earned at the old rate before switching
+        self._refill()
+        self._rate = max(float(value), 1e-6)
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Wait until one token is available and take it."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Serialise waiters so tokens are handed out in FIFO order
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+class AimdController:
+    """
+    Additive-increase / multiplicative-decrease controller for request rate and concurrency.
+
+    Every finished lookup is reported through observe(). Clean, fast answers nudge the bucket
+    rate up by `increase` req/s (and the concurrency limit up by one per full window of
+    successes); timeouts, blocked/captcha pages, errors or a latency spike cut both by
+    `decrease`, at most once per `cooldown` seconds so a burst of failures that were already
+    in flight only counts as one congestion event.
+    """
+
+    def __init__(
+        self,
+        bucket,
+        max_concurrency,
+        min_rate=0.05,
+        max_rate=5.0,
+        increase=0.05,
+        decrease=0.5,
+        cooldown=5.0,
+        slow_factor=3.0,
+        min_slow_seconds=5.0,
+        clock=time.monotonic,
+    ):
+        self.bucket = bucket
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, min_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.slow_factor = slow_factor
+        self.min_slow_seconds = min_slow_seconds
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.limit = self.max_concurrency
+        self._clock = clock
+        self._last_cut = None
+        self._successes = 0
+        self._latency_ewma = None
+        self._in_flight = 0
+        self._cond = None
+        self.bucket.rate = min(max(bucket.rate, self.min_rate), self.max_rate)
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    async def acquire(self):
+        """Wait for a free concurrency slot under the current limit."""
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    async def release(self):
+        async with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _is_slow(self, latency):
+        if latency is None or self._latency_ewma is None:
+            return False
+        return latency > max(self.slow_factor * self._latency_ewma, self.min_slow_seconds)
+
+    def observe(self, congested, latency=None):
+        """
+        Record one lookup outcome. Returns True when it backed off or raised the concurrency
+        limit (worth logging); small additive rate increases return False.
+        congested: the site timed out, blocked us or errored.
+        """
+        if congested or self._is_slow(latency):
+            now = self._clock()
+            if self._last_cut is not None and now - self._last_cut < self.cooldown:
+                return False
+            self._last_cut = now
+            self._successes = 0
+            self.bucket.rate = max(self.min_rate, self.bucket.rate * self.decrease)
+            self.limit = max(1, int(self.limit * self.decrease))
+            return True
+
+        if latency is not None:
+            self._latency_ewma = latency if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * latency
+        self.bucket.rate = min(self.max_rate, self.bucket.rate + self.increase)
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.max_concurrency:
+            self._successes = 0
+            self.limit += 1
+            return True
+        return False